@@ -1,11 +1,21 @@
 import os
 
-from flask import Flask, render_template, flash, redirect, session, g
-
-from models import db, connect_db, User, Character, Stats, Char_Class, Classes, Spell, SpellList
+from flask import Flask, render_template, flash, redirect, session, g, request, jsonify
+from sqlalchemy import delete, insert, tuple_
+from sqlalchemy.orm import selectinload
+
+import catalog
+import dnd_api
+import instrumentation
+from models import db, connect_db, User, CurrentUser, UserNotFound, Character, Stats, Char_Class, Spell, SpellList, SpellListSpells
+from spell_search import search_spells
 from forms import UserSignUpForm, UserLoginForm, DeleteUserForm, CharacterCreationForm, SpellListForm 
 
 CURR_USER_KEY = "curr_user"
+CURR_USERNAME_KEY = "curr_username"
+
+SPELL_PAGE_SIZE = 50
+MAX_SPELL_PAGE_SIZE = 200
 
 app = Flask(__name__)
 
@@ -14,12 +24,55 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///spell-tracker'))
 
+# Connection pool for the SQLAlchemy engine, set DB_PGBOUNCER=true when
+# connecting through pgbouncer in transaction pooling mode
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 30 * 60))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+app.config['DB_STATEMENT_TIMEOUT'] = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+app.config['DB_PGBOUNCER'] = os.environ.get('DB_PGBOUNCER', 'false').lower() == 'true'
+
+# Optional read replica, GET requests read from it unless the user wrote
+# to the primary in the last REPLICA_STICKY_SECONDS
+if os.environ.get('DATABASE_REPLICA_URL'):
+    app.config['SQLALCHEMY_BINDS'] = {'replica': os.environ['DATABASE_REPLICA_URL']}
+app.config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 # app.config['DEBUG'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 
+# In-process cache for dnd5eapi responses
+app.config['DND_API_CACHE_SIZE'] = int(os.environ.get('DND_API_CACHE_SIZE', 256))
+app.config['DND_API_CACHE_TTL'] = int(os.environ.get('DND_API_CACHE_TTL', 60 * 60))
+
+# Pooled client for dnd5eapi requests
+app.config['DND_API_POOL_SIZE'] = int(os.environ.get('DND_API_POOL_SIZE', 10))
+app.config['DND_API_CONNECT_TIMEOUT'] = float(os.environ.get('DND_API_CONNECT_TIMEOUT', 3.05))
+app.config['DND_API_READ_TIMEOUT'] = float(os.environ.get('DND_API_READ_TIMEOUT', 10))
+app.config['DND_API_RETRIES'] = int(os.environ.get('DND_API_RETRIES', 3))
+app.config['DND_API_BACKOFF'] = float(os.environ.get('DND_API_BACKOFF', 0.5))
+app.config['DND_API_BREAKER_THRESHOLD'] = int(os.environ.get('DND_API_BREAKER_THRESHOLD', 5))
+app.config['DND_API_BREAKER_COOLDOWN'] = int(os.environ.get('DND_API_BREAKER_COOLDOWN', 30))
+app.config['DND_API_LATENCY_STATS'] = os.environ.get('DND_API_LATENCY_STATS', 'true').lower() == 'true'
+
+# Per-request query counts in response headers and logs
+app.config['SQL_QUERY_STATS'] = os.environ.get('SQL_QUERY_STATS', 'false').lower() == 'true'
+app.config['SQL_N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 3))
+
+# Connection pool and api client stats as json on /_metrics
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+
+# Seconds between checks for new api data from the seeder
+app.config['CATALOG_VERSION_CHECK_INTERVAL'] = int(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 60))
+
 connect_db(app)
+catalog.init_app(app)
+dnd_api.init_app(app)
+instrumentation.init_app(app)
 
 app.app_context().push()
 
@@ -28,16 +81,35 @@ app.app_context().push()
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
-    if CURR_USER_KEY in session:
+    if CURR_USER_KEY in session and CURR_USERNAME_KEY in session:
+        # the user row is only loaded if a view needs more than the id and username
+        g.user = CurrentUser(session[CURR_USER_KEY], session[CURR_USERNAME_KEY])
+
+    elif CURR_USER_KEY in session:
+        # sessions from before the username was stored
         g.user = db.session.get(User, session[CURR_USER_KEY])
 
+        if g.user:
+            session[CURR_USERNAME_KEY] = g.user.username
+
     else:
         g.user = None
 
+@app.errorhandler(UserNotFound)
+def log_out_deleted_user(err):
+    """The session belongs to an account that no longer exists, so treat them as logged out."""
+
+    do_logout()
+    g.user = None
+
+    flash("Your account no longer exists, please log in again", 'error')
+    return redirect('/')
+
 def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    session[CURR_USERNAME_KEY] = user.username
 
 
 def do_logout():
@@ -46,6 +118,9 @@ def do_logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
 
+    if CURR_USERNAME_KEY in session:
+        del session[CURR_USERNAME_KEY]
+
 @app.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
@@ -124,7 +199,17 @@ def show_user_page(user_id):
         flash("You can't access another users profile", 'error')
         redirect('/')
 
-    return render_template('users/details.html', user=g.user, chars=g.user.characters)
+    # load the characters and their spell lists up front, the template walks both
+    user = (db.session.query(User)
+            .options(selectinload(User.characters).selectinload(Character.spell_lists))
+            .filter(User.id == g.user.id)
+            .execution_options(populate_existing=True)
+            .one_or_none())
+
+    if user is None:
+        raise UserNotFound(g.user.id)
+
+    return render_template('users/details.html', user=user, chars=user.characters)
 
 @app.route('/user/<int:user_id>/delete', methods=['GET','POST'])
 def delete_user(user_id):
@@ -133,23 +218,20 @@ def delete_user(user_id):
 
     if g.user.id != user_id:
         flash("You can't delete another user", 'error')
-        redirect('/')
+        return redirect('/')
 
     form = DeleteUserForm()
 
     if form.validate_on_submit():
+        username = user.username
 
-        # Delete the users characters first
-        for char in user.characters:
-            db.session.delete(char)
-
+        # the database cascades the delete to the users characters and everything they own
+        db.session.execute(delete(User).where(User.id == user_id))
         db.session.commit()
 
-        #then delete user
-        db.session.delete(user)
-        db.session.commit()
+        do_logout()
 
-        flash(f'Deleted {user.username} account', 'success')
+        flash(f'Deleted {username} account', 'success')
         return redirect('/')
     
     return render_template('users/delete.html', user=user, form=form)
@@ -167,13 +249,13 @@ def show_character_form():
 
     form = CharacterCreationForm()
 
-    # Pass in list of character class names from class table
-    form.class_id.choices = [(_class.id, _class.name) for _class in db.session.query(Classes).all()]
-
     if form.validate_on_submit():
 
         user = db.session.get(User, g.user.id)
 
+        if user is None:
+            raise UserNotFound(g.user.id)
+
         char = Character(
             name=form.data['name']
         )
@@ -209,7 +291,7 @@ def show_char_details(char_id):
     '''Show the character details page'''
 
     owner = False
-    if g.user and char_id in [char.id for char in g.user.characters]:
+    if g.user and g.user.owns_character(char_id):
         owner = True
 
     char = db.session.get(Character, char_id)
@@ -226,7 +308,6 @@ def char_edit_form(char_id):
     char = db.session.get(Character, char_id)
 
     form = CharacterCreationForm(data=char.serialize_character(), class_id=char.classes[0].class_name.id)
-    form.class_id.choices = [(_class.id, _class.name) for _class in db.session.query(Classes).all()]
 
     if g.user.id != char.user_id:
         flash("You can not edit another users characters", 'error')
@@ -278,30 +359,28 @@ def new_spell_list_form(char_id):
         flash(f'No spells available for {char.name}', 'error')
         return redirect(f'/char/{char_id}')
     
-    #get all spells in db available to character
-    spells = char.get_spells_from_db(slots_by_class)
-
     form = SpellListForm()
-    form.spells.choices = [(spell.id, spell.name) for spell in spells]
     stats = char.stats.serialize_stats().items()
 
     if form.validate_on_submit():
         spell_list = SpellList(char_id=char.id, name=form.data['name'])
+        db.session.add(spell_list)
+        db.session.flush()
 
-        # spells returned with the hidden select field
-        selected_spells = form.data['spells']
-
-        for spell in spells:
-            if spell.id in selected_spells:
-                spell_list.spells.append(spell)
+        # spells returned with the hidden select field, keeping only the ones available to the character
+        selected_spells = {_id for _id, in char.get_spells_from_db(slots_by_class)
+                                               .with_entities(Spell.id)
+                                               .filter(Spell.id.in_(form.data['spells']))}
 
-        db.session.add(spell_list)
+        if selected_spells:
+            db.session.execute(insert(SpellListSpells),
+                               [{'list_id': spell_list.id, 'spell_id': spell_id} for spell_id in sorted(selected_spells)])
         db.session.commit()
 
         flash(f'Successdully created {spell_list.name} for {char.name}', 'success')
         return redirect(f'/char/{char.id}/spell_list/{spell_list.id}')
 
-    return render_template('spell_list/new_spell_list.html', char=char, spells=spells, slots=slots_by_class, stats=stats, form=form)
+    return render_template('spell_list/new_spell_list.html', char=char, slots=slots_by_class, stats=stats, form=form)
 
 @app.route('/char/<int:char_id>/spell_list/<int:spell_list_id>')
 def show_spell_list_details(char_id, spell_list_id):
@@ -329,4 +408,106 @@ def delete_spell_list(spell_list_id):
     db.session.commit()
 
     flash(f'Successfully deleted {spell_list.name}', 'success')
-    return redirect(f'/char/{spell_list.char_id}')
\ No newline at end of file
+    return redirect(f'/char/{spell_list.char_id}')
+
+###################### API VIEWS #####################################
+@app.route('/api/spells')
+def get_spell_details():
+    '''Returns the details for a comma separated list of spell ids,
+    e.g. /api/spells?ids=1,2,3, so a whole list of spell cards
+    can get their details in one request'''
+    try:
+        ids = {int(_id) for _id in request.args.get('ids', '').split(',') if _id}
+    except ValueError:
+        return jsonify(error='ids must be a comma separated list of integers'), 400
+
+    spells = db.session.query(Spell).filter(Spell.id.in_(ids)).all() if ids else []
+
+    return jsonify(spells=[spell.serialize_details() for spell in spells])
+
+@app.route('/api/char/<int:char_id>/spells')
+def get_available_spells(char_id):
+    '''Returns a page of the spells available to a character, ordered by
+    level and name, with each spells rendered card.
+
+    Pages are keyed on the last spell of the previous page, pass the level
+    and name from "next" to get the following page,
+    e.g. /api/char/1/spells?level=1&name=Cure%20Wounds&limit=50
+
+    Pass a comma separated list of ids instead to get those spells, like
+    the cards for search results that haven't been loaded yet,
+    e.g. /api/char/1/spells?ids=1,2,3'''
+    char = db.session.get(Character, char_id)
+
+    if not g.user or not char or g.user.id != char.user_id:
+        return jsonify(error="You can not build a spell list for another users character"), 403
+
+    try:
+        limit = min(int(request.args.get('limit', SPELL_PAGE_SIZE)), MAX_SPELL_PAGE_SIZE)
+        level = int(request.args['level']) if 'level' in request.args else None
+        ids = [int(_id) for _id in request.args['ids'].split(',') if _id] if 'ids' in request.args else None
+    except ValueError:
+        return jsonify(error='limit, level and ids must be integers'), 400
+
+    if limit < 1:
+        return jsonify(error='limit must be at least 1'), 400
+
+    slots_by_class = char.get_spell_slots()
+
+    if len(slots_by_class) == 0:
+        return jsonify(spells=[], next=None)
+
+    spells = char.get_spells_from_db(slots_by_class)
+
+    if ids is not None:
+        spells = spells.filter(Spell.id.in_(ids[:limit])).all()
+        return jsonify(spells=[dict(spell.serialize_summary(), card=catalog.spell_card(spell)) for spell in spells],
+                       next=None)
+
+    if level is not None:
+        spells = spells.filter(tuple_(Spell.level, Spell.name) > (level, request.args.get('name', '')))
+
+    # get one extra spell to know if there is another page
+    spells = spells.limit(limit + 1).all()
+    page = spells[:limit]
+
+    next_page = None
+    if len(spells) > limit:
+        next_page = {'level': page[-1].level, 'name': page[-1].name}
+
+    return jsonify(spells=[dict(spell.serialize_summary(), card=catalog.spell_card(spell)) for spell in page],
+                   next=next_page)
+
+@app.route('/api/char/<int:char_id>/spells/search')
+def search_available_spells(char_id):
+    '''Returns the ids of the spells available to a character that match
+    the filters, in level and name order,
+    e.g. /api/char/1/spells/search?name=cure&level=1&school=evocation&healing=true
+
+    damaging, healing and concentration only filter when set to true'''
+    char = db.session.get(Character, char_id)
+
+    if not g.user or not char or g.user.id != char.user_id:
+        return jsonify(error="You can not build a spell list for another users character"), 403
+
+    try:
+        level = int(request.args['level']) if request.args.get('level') else None
+    except ValueError:
+        return jsonify(error='level must be an integer'), 400
+
+    slots_by_class = char.get_spell_slots()
+
+    if len(slots_by_class) == 0:
+        return jsonify(ids=[])
+
+    available = [_id for _id, in char.get_spells_from_db(slots_by_class).with_entities(Spell.id)]
+
+    ids = search_spells(available,
+                        name=request.args.get('name'),
+                        level=level,
+                        school=request.args.get('school'),
+                        damaging=request.args.get('damaging') == 'true',
+                        healing=request.args.get('healing') == 'true',
+                        concentration=request.args.get('concentration') == 'true')
+
+    return jsonify(ids=ids)
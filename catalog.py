@@ -0,0 +1,103 @@
+"""In-process caches of the api data (classes, spells) and the html
+rendered from it for Spell Tracker.
+
+The api data only changes when seed.py runs. The seeder bumps the version in
+the catalog_version table, and each app process checks that version at most
+once every CATALOG_VERSION_CHECK_INTERVAL seconds, clearing its caches when
+it changes.
+"""
+
+import threading
+import time
+
+from flask import render_template
+from markupsafe import Markup
+
+# a module import, models imports this module for seeded_class_spells
+import models
+
+check_interval = 60
+
+_lock = threading.Lock()
+_caches = {}
+_version = None
+_checked_at = None
+
+def init_app(app):
+    '''Configure the version check interval from the Flask app config and
+    make the cached fragments available to templates'''
+    global check_interval
+
+    check_interval = app.config.get('CATALOG_VERSION_CHECK_INTERVAL', check_interval)
+    app.add_template_global(spell_card)
+
+def catalog_version():
+    '''Returns the current catalog version, checking the database at most
+    once every check_interval seconds'''
+    global _version, _checked_at
+
+    if _checked_at is None or time.monotonic() - _checked_at >= check_interval:
+        version = models.db.session.query(models.CatalogVersion.version).filter_by(id=1).scalar() or 0
+
+        with _lock:
+            if version != _version:
+                _caches.clear()
+                _version = version
+            _checked_at = time.monotonic()
+
+    return _version
+
+def cached(key, load):
+    '''Returns the cached value for key, calling load() to build it if it
+    isn't cached for the current catalog version'''
+    catalog_version()
+
+    value = _caches.get(key)
+    if value is None:
+        value = load()
+        with _lock:
+            _caches[key] = value
+
+    return value
+
+def invalidate():
+    '''Clear this processes caches and check the version on the next lookup'''
+    global _version, _checked_at
+
+    with _lock:
+        _caches.clear()
+        _version = None
+        _checked_at = None
+
+def bump_version():
+    '''Mark the api data as changed for every app process, the seeder calls
+    this after it loads api data'''
+
+    # based on the time so the version keeps going up even when
+    # a full seed drops and recreates the table
+    version = int(time.time())
+    row = models.db.session.get(models.CatalogVersion, 1)
+
+    if row is None:
+        models.db.session.add(models.CatalogVersion(id=1, version=version))
+    else:
+        row.version = max(row.version + 1, version)
+
+    models.db.session.commit()
+    invalidate()
+
+def class_choices():
+    '''Returns (id, name) choices for the character class select field'''
+    return cached('class_choices',
+                  lambda: [(_class.id, _class.name) for _class in models.db.session.query(models.Classes).order_by(models.Classes.id)])
+
+def seeded_class_spells():
+    '''Returns the set of class indexes that have spells in the class_spells table'''
+    return cached('seeded_class_spells',
+                  lambda: {class_index for class_index, in models.db.session.query(models.ClassSpell.class_index).distinct()})
+
+def spell_card(spell):
+    '''Returns the rendered header and body of a spells card, the outer card
+    div is left to each page so it can add its own attributes'''
+    return cached(('spell_card', spell.id),
+                  lambda: Markup(render_template('spell_list/spell_card.html', spell=spell)))
@@ -0,0 +1,232 @@
+"""Requests to the dnd5eapi for Spell Tracker."""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+base_url = 'https://www.dnd5eapi.co'
+
+class TTLCache:
+    '''Bounded in-process cache for api responses.
+
+    Entries expire after `ttl` seconds, and once the cache holds `max_size`
+    entries the least recently used entry is evicted to make room.'''
+
+    def __init__(self, max_size=256, ttl=60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''Returns the cached value for key, or None if it is missing or expired'''
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            # mark as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        '''Adds value to the cache, evicting the least recently used entries if full'''
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        '''Returns a dict of cache counters'''
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+class ApiUnavailable(requests.RequestException):
+    '''Raised without making a request while the circuit breaker is open'''
+
+class ApiClient:
+    '''Shared client for all dnd5eapi traffic.
+
+    Keeps a pool of keep-alive connections to the api, applies connect/read
+    timeouts and retries failed requests with backoff. After `breaker_threshold`
+    failures in a row the circuit breaker opens and requests fail fast with
+    ApiUnavailable for `breaker_cooldown` seconds. A breaker_threshold of
+    None turns the breaker off.'''
+
+    def __init__(self, **options):
+        self.failures = 0
+        self.opened_at = None
+
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+        self._lock = threading.Lock()
+
+        self.configure(**options)
+
+    def configure(self, pool_size=10, connect_timeout=3.05, read_timeout=10,
+                  retries=3, backoff=0.5, breaker_threshold=5, breaker_cooldown=30,
+                  track_latency=True):
+        '''Set client options, replacing the connection pool'''
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.track_latency = track_latency
+
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def breaker_open(self):
+        '''Returns True while the circuit breaker is refusing requests'''
+        if self.opened_at is None:
+            return False
+
+        if time.monotonic() - self.opened_at >= self.breaker_cooldown:
+            # let the next request through to test the api
+            self.opened_at = None
+            return False
+
+        return True
+
+    def get_json(self, path):
+        '''Makes a get request to an api path and returns the json response'''
+
+        if self.breaker_open():
+            raise ApiUnavailable(f'dnd5eapi circuit breaker open, not requesting {path}')
+
+        start = time.monotonic()
+        try:
+            resp = self.session.get(f'{base_url}{path}', timeout=self.timeout)
+            resp.raise_for_status()
+            data = resp.json()
+        except (requests.RequestException, ValueError):
+            self._record(start, failed=True)
+            raise
+
+        self._record(start, failed=False)
+        return data
+
+    def _record(self, start, failed):
+        '''Update latency stats and the circuit breaker after a request'''
+        elapsed = time.monotonic() - start
+
+        with self._lock:
+            self.requests += 1
+
+            if self.track_latency:
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+
+            if failed:
+                self.errors += 1
+                self.failures += 1
+                if self.breaker_threshold is not None and self.failures >= self.breaker_threshold:
+                    self.opened_at = time.monotonic()
+            else:
+                self.failures = 0
+
+    def stats(self):
+        '''Returns a dict of request counters and latency in milliseconds'''
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'avg_ms': round(self.total_time / self.requests * 1000, 2) if self.requests else 0,
+            'max_ms': round(self.max_time * 1000, 2),
+            'breaker_open': self.opened_at is not None
+        }
+
+api_cache = TTLCache()
+client = ApiClient()
+
+def init_app(app):
+    '''Configure the api client and cache from the Flask app config'''
+
+    api_cache.max_size = app.config.get('DND_API_CACHE_SIZE', api_cache.max_size)
+    api_cache.ttl = app.config.get('DND_API_CACHE_TTL', api_cache.ttl)
+
+    client.configure(
+        pool_size=app.config.get('DND_API_POOL_SIZE', 10),
+        connect_timeout=app.config.get('DND_API_CONNECT_TIMEOUT', 3.05),
+        read_timeout=app.config.get('DND_API_READ_TIMEOUT', 10),
+        retries=app.config.get('DND_API_RETRIES', 3),
+        backoff=app.config.get('DND_API_BACKOFF', 0.5),
+        breaker_threshold=app.config.get('DND_API_BREAKER_THRESHOLD', 5),
+        breaker_cooldown=app.config.get('DND_API_BREAKER_COOLDOWN', 30),
+        track_latency=app.config.get('DND_API_LATENCY_STATS', True)
+    )
+
+def get_json(path):
+    '''Returns the json response for an api path, e.g. /api/classes/wizard/spells
+
+    Responses are cached by url, the api data only changes between SRD releases.'''
+
+    url = f'{base_url}{path}'
+
+    data = api_cache.get(url)
+    if data is None:
+        data = client.get_json(path)
+        api_cache.set(url, data)
+
+    return data
+
+def get_many_json(paths):
+    '''Returns a list of json responses for a list of api paths, in the same order.
+
+    The requests are made at the same time so the total wait is about that
+    of the slowest request.'''
+
+    if len(paths) <= 1:
+        return [get_json(path) for path in paths]
+
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        return list(executor.map(get_json, paths))
+
+def get_unseeded_class_json(class_names, resource, seeded):
+    '''Returns {class name: json response} from /api/classes/<class name>/<resource>
+    for each class that isn't in seeded, the fallback for classes our mirror of
+    the api has no data for. The classes are requested at the same time.'''
+    missing = list(dict.fromkeys(name for name in class_names if name not in seeded))
+    responses = get_many_json([f'/api/classes/{name}/{resource}' for name in missing])
+
+    return dict(zip(missing, responses))
@@ -3,6 +3,7 @@
 from wtforms import StringField, PasswordField, SelectField, SelectMultipleField, BooleanField, validators, ValidationError
 from flask_wtf import FlaskForm
 from wtforms_alchemy import model_form_factory, ModelFormField
+from catalog import class_choices
 from models import db, User, Character, Stats, Classes, Char_Class
 
 BaseModelForm = model_form_factory(FlaskForm)
@@ -41,6 +42,8 @@ class UserLoginForm(FlaskForm):
 class DeleteUserForm(FlaskForm):
     '''Form for users to confirm they want to delete their account'''
 
+# wtforms_alchemy generates the model fields once, when these classes are
+# defined at import, so each CharacterCreationForm only binds them
 class CharacterModelForm(ModelForm):
     class Meta:
         model = Character
@@ -56,7 +59,15 @@ class CharacterCreationForm(CharClassModelForm):
     class Meta:
         model = Stats
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # class names are cached in-process until the seeder changes them
+        self.class_id.choices = class_choices()
+
 class SpellListForm(FlaskForm):
     '''Hidden form to track spells user selects'''
     name = StringField('Spell List Name', [validators.Length(min=3, max=50), validators.DataRequired()])
-    spells = SelectMultipleField('Spells', coerce=int)
\ No newline at end of file
+    # options are added by spell_list.js as spells are dropped in the list,
+    # the view checks the ids against the characters available spells
+    spells = SelectMultipleField('Spells', choices=[], coerce=int, validate_choice=False)
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""SQL query and connection pool instrumentation for Spell Tracker."""
+
+import logging
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request, jsonify
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+import dnd_api
+
+logger = logging.getLogger('spell_tracker.sql')
+
+def statement_shape(statement):
+    '''Returns the statement with whitespace and IN lists collapsed, so the
+    same query with different parameters has the same shape'''
+    shape = re.sub(r'\s+', ' ', statement).strip()
+    # psycopg2 placeholders like %(id_1_1)s have parentheses of their own
+    return re.sub(r'IN \((?:%\(\w+\)s|[^()])*\)', 'IN (...)', shape)
+
+class TimedQueuePool(QueuePool):
+    '''QueuePool that records how long checkouts wait for a connection'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.checkouts = 0
+        self.checkout_wait = 0.0
+        self.max_checkout_wait = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            self.checkouts += 1
+            self.checkout_wait += wait
+            self.max_checkout_wait = max(self.max_checkout_wait, wait)
+
+    def stats(self):
+        '''Returns a dict of pool size, connections in use and checkout waits'''
+        return {
+            'size': self.size(),
+            'in_use': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'checkouts': self.checkouts,
+            'avg_checkout_wait_ms': round(self.checkout_wait / self.checkouts * 1000, 2) if self.checkouts else 0,
+            'max_checkout_wait_ms': round(self.max_checkout_wait * 1000, 2)
+        }
+
+def init_app(app):
+    '''Count the statements and db time of every request.
+
+    When SQL_QUERY_STATS is set, each response gets X-Query-Count and
+    X-Query-Time-Ms headers and a summary is logged for the route. Statement
+    shapes repeated SQL_N_PLUS_ONE_THRESHOLD or more times in one request
+    are logged as likely N+1 queries.
+
+    When METRICS_ENABLED is set, /_metrics returns connection pool and
+    dnd5eapi client stats as json.'''
+
+    app.config.setdefault('SQL_QUERY_STATS', False)
+    app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 3)
+
+    @app.before_request
+    def start_query_stats():
+        if app.config['SQL_QUERY_STATS']:
+            g.query_stats = {'count': 0, 'time': 0.0, 'shapes': Counter()}
+
+    @app.after_request
+    def report_query_stats(resp):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return resp
+
+        resp.headers['X-Query-Count'] = str(stats['count'])
+        resp.headers['X-Query-Time-Ms'] = f"{stats['time'] * 1000:.1f}"
+
+        route = request.endpoint or request.path
+        logger.info('%s %s: %d queries in %.1f ms', request.method, route,
+                    stats['count'], stats['time'] * 1000)
+
+        for shape, count in stats['shapes'].items():
+            if count >= app.config['SQL_N_PLUS_ONE_THRESHOLD']:
+                logger.warning('%s %s: likely N+1, statement ran %d times: %s',
+                               request.method, route, count, shape)
+
+        return resp
+
+    if app.config.get('METRICS_ENABLED'):
+        @app.route('/_metrics')
+        def show_metrics():
+            '''Returns connection pool and dnd5eapi client stats as json'''
+            # models imports this module for TimedQueuePool
+            from models import db
+
+            pools = {bind or 'default': engine.pool.stats() for bind, engine in db.engines.items()
+                     if isinstance(engine.pool, TimedQueuePool)}
+
+            return jsonify(db_pools=pools, dnd_api=dnd_api.client.stats(), dnd_api_cache=dnd_api.api_cache.stats())
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+    stats = g.get('query_stats') if has_request_context() else None
+    if stats is not None:
+        stats['count'] += 1
+        stats['time'] += elapsed
+        stats['shapes'][statement_shape(statement)] += 1
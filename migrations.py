@@ -0,0 +1,155 @@
+'''Versioned schema migrations for Spell Tracker.
+
+    python migrations.py            apply pending migrations
+    python migrations.py status     list applied and pending migrations
+    python migrations.py explain    show the query plans each migration affects
+
+New databases get the current schema from db.create_all(), so every
+migration must be safe to run against a database that already has its
+changes (ADD COLUMN IF NOT EXISTS, CREATE INDEX IF NOT EXISTS, ...).
+Add new migrations to the end of MIGRATIONS with the next version number,
+and list the queries they affect in `explain` so their plans are printed
+before and after the migration runs.
+'''
+
+import argparse
+
+from sqlalchemy import text
+
+from app import db
+
+MIGRATIONS = [
+    {
+        'version': 1,
+        'description': 'Add spell detail columns',
+        'statements': [
+            'ALTER TABLE spells ADD COLUMN IF NOT EXISTS description TEXT',
+            'ALTER TABLE spells ADD COLUMN IF NOT EXISTS higher_level TEXT',
+            'ALTER TABLE spells ADD COLUMN IF NOT EXISTS components VARCHAR',
+            'ALTER TABLE spells ADD COLUMN IF NOT EXISTS material TEXT',
+            'ALTER TABLE spells ADD COLUMN IF NOT EXISTS ritual BOOLEAN',
+            'ALTER TABLE spells ADD COLUMN IF NOT EXISTS attack_type VARCHAR',
+            'ALTER TABLE spells ADD COLUMN IF NOT EXISTS damage_type VARCHAR',
+            'ALTER TABLE spells ADD COLUMN IF NOT EXISTS area_of_effect VARCHAR',
+        ],
+        'explain': []
+    },
+    {
+        'version': 2,
+        'description': 'Add indexes for joins and filters on the hot paths',
+        # build the indexes without locking the tables against writes,
+        # CONCURRENTLY can't run inside a transaction
+        'transaction': False,
+        'statements': [
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_characters_user_id ON characters (user_id)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_char_classes_char_id ON char_classes (char_id)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_spell_lists_char_id ON spell_lists (char_id)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_spell_list_spells_list_id_spell_id ON spell_list_spells (list_id, spell_id)',
+            # with the SRD's 319 spells postgres still plans a seq scan and sort for the
+            # level filter, the index only pays off once homebrew grows the table
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_spells_level ON spells (level)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_class_spells_class_index_spell_index ON class_spells (class_index, spell_index)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_class_levels_class_index_level ON class_levels (class_index, level)',
+        ],
+        'explain': [
+            'SELECT * FROM characters WHERE user_id = 1',
+            'SELECT * FROM char_classes WHERE char_id = 1',
+            'SELECT * FROM spell_lists WHERE char_id = 1',
+            'SELECT spells.* FROM spells JOIN spell_list_spells ON spells.id = spell_list_spells.spell_id '
+            'WHERE spell_list_spells.list_id = 1',
+            'SELECT * FROM spells WHERE level <= 3 ORDER BY level, name',
+            "SELECT spell_index FROM class_spells WHERE class_index = 'wizard'",
+            "SELECT * FROM class_levels WHERE class_index = 'wizard' AND level = 5",
+        ]
+    },
+    {
+        'version': 3,
+        'description': 'Add catalog version table',
+        'statements': [
+            'CREATE TABLE IF NOT EXISTS catalog_version (id INTEGER PRIMARY KEY, version BIGINT NOT NULL)',
+        ],
+        'explain': []
+    },
+]
+
+def create_migrations_table():
+    with db.engine.begin() as conn:
+        conn.execute(text('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                                version INTEGER PRIMARY KEY,
+                                description VARCHAR NOT NULL,
+                                applied_at TIMESTAMP NOT NULL DEFAULT now())'''))
+
+def applied_versions():
+    '''Returns the set of migration versions applied to the database'''
+    create_migrations_table()
+
+    with db.engine.connect() as conn:
+        return {row.version for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+def explain(queries):
+    '''Print the query plan for each query'''
+    with db.engine.connect() as conn:
+        for query in queries:
+            print(f'  {query}')
+            for row in conn.execute(text(f'EXPLAIN {query}')):
+                print(f'    {row[0]}')
+
+def apply_migration(migration):
+    '''Run a migrations statements and record its version'''
+
+    if migration.get('transaction', True):
+        with db.engine.begin() as conn:
+            for statement in migration['statements']:
+                conn.execute(text(statement))
+    else:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for statement in migration['statements']:
+                conn.execute(text(statement))
+
+    with db.engine.begin() as conn:
+        conn.execute(text('INSERT INTO schema_migrations (version, description) VALUES (:version, :description)'),
+                     {'version': migration['version'], 'description': migration['description']})
+
+def upgrade():
+    '''Apply every pending migration in order, printing the query plans
+    the migration affects before and after it runs'''
+    applied = applied_versions()
+    pending = [migration for migration in MIGRATIONS if migration['version'] not in applied]
+
+    if not pending:
+        print('Database is up to date')
+
+    for migration in pending:
+        print(f"Applying {migration['version']}: {migration['description']}")
+
+        if migration['explain']:
+            print('Before:')
+            explain(migration['explain'])
+
+        apply_migration(migration)
+
+        if migration['explain']:
+            print('After:')
+            explain(migration['explain'])
+
+def status():
+    applied = applied_versions()
+
+    for migration in MIGRATIONS:
+        state = 'applied' if migration['version'] in applied else 'pending'
+        print(f"{migration['version']}: {migration['description']} ({state})")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Spell Tracker schema migrations')
+    parser.add_argument('command', nargs='?', default='upgrade', choices=['upgrade', 'status', 'explain'])
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        status()
+    elif args.command == 'explain':
+        for migration in MIGRATIONS:
+            if migration['explain']:
+                print(f"{migration['version']}: {migration['description']}")
+                explain(migration['explain'])
+    else:
+        upgrade()
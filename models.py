@@ -1,15 +1,60 @@
 """SQLAlchemy models for Spell Tracker."""
 
-import requests
+import time
 from datetime import datetime
 
+from flask import g, has_request_context, request, session
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool
 
-base_url = 'https://www.dnd5eapi.co'
+import catalog
+from dnd_api import get_unseeded_class_json
+from instrumentation import TimedQueuePool
+
+LAST_WRITE_KEY = "last_db_write"
+
+class RoutingSession(Session):
+    """Session that sends the reads of read-only requests to the
+    replica database, when one is configured.
+
+    Flushes and everything outside of a read-only request use the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('use_replica'):
+            return self._db.engines['replica']
+
+        return super().get_bind(mapper, clause, bind, **kwargs)
 
 bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def engine_options(config):
+    """Build SQLAlchemy engine options from the DB_* app config.
+
+    With DB_PGBOUNCER set the app keeps no connections of its own and
+    leaves pooling to pgbouncer in transaction pooling mode.
+    """
+
+    if config['DB_PGBOUNCER']:
+        return {'poolclass': NullPool}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+    if config['DB_STATEMENT_TIMEOUT']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"}
+
+    return options
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -17,9 +62,51 @@ def connect_db(app):
     You should call this in your Flask app.
     """
 
+    if 'DB_PGBOUNCER' in app.config:
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+
     db.app = app
     db.init_app(app)
 
+    if 'replica' in app.config.get('SQLALCHEMY_BINDS', {}):
+        init_replica_routing(app)
+
+    if app.config.get('DB_PGBOUNCER') and app.config.get('DB_STATEMENT_TIMEOUT'):
+        # pgbouncer hands each transaction a different server connection,
+        # so session settings have to be set in every transaction, on every bind
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(app.config['DB_STATEMENT_TIMEOUT'])}")
+
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'begin', set_statement_timeout)
+
+def init_replica_routing(app):
+    """Send GET requests to the replica bind, unless this user committed
+    a write in the last REPLICA_STICKY_SECONDS so they read their own writes.
+    """
+
+    # init_app makes an empty metadata for the bind, the replica gets its tables
+    # from the primary so create_all and drop_all should leave it alone
+    db.metadatas.pop('replica', None)
+
+    @app.before_request
+    def route_to_replica():
+        recent_write = time.time() - session.get(LAST_WRITE_KEY, 0) < app.config['REPLICA_STICKY_SECONDS']
+        g.use_replica = request.method in ('GET', 'HEAD') and not recent_write
+
+    @event.listens_for(db.session, 'after_commit')
+    def record_write(db_session):
+        if has_request_context():
+            g.db_write = True
+
+    @app.after_request
+    def remember_write(resp):
+        if g.pop('db_write', False):
+            session[LAST_WRITE_KEY] = time.time()
+
+        return resp
+
 class User(db.Model):
     """User in the system."""
 
@@ -97,21 +184,61 @@ class User(db.Model):
         This will prevent users from having multiples of the same character
         while allowing users to have characters with names already taken by other users'''
 
-        if name in [char.name for char in self.characters]:
-            return True
-        else:
-            return False
+        return db.session.query(
+            db.exists().where(Character.user_id == self.id, Character.name == name)
+        ).scalar()
+
+    def owns_character(self, char_id):
+        '''Returns true if the character with char_id belongs to this user,
+        without loading the users characters'''
+
+        return db.session.query(
+            db.exists().where(Character.id == char_id, Character.user_id == self.id)
+        ).scalar()
         
     def has_spell_lists(self):
         '''This method will determine if a user has any spell lists
         associated with their account. This makes things easier for us
         when we are designing the user details page'''
-        for char in self.characters:
-            if len(char.spell_lists) > 0:
-                return True
-        
-        return False
+
+        return db.session.query(
+            db.exists().where(SpellList.char_id == Character.id, Character.user_id == self.id)
+        ).scalar()
     
+class UserNotFound(Exception):
+    '''The logged in users row was deleted after they logged in'''
+
+class CurrentUser:
+    '''Stand-in for the logged in User on g.user.
+
+    The id and username come from the signed session, so views that only
+    need those don't load the users row. Any other attribute loads the
+    User from the database the first time it is used, raising UserNotFound
+    if the account has been deleted since the session was made.'''
+
+    def __init__(self, user_id, username):
+        self.id = user_id
+        self.username = username
+        self._user = None
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    def __getattr__(self, name):
+        # only called for attributes not set in __init__
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+
+            if self._user is None:
+                raise UserNotFound(self.id)
+
+        return getattr(self._user, name)
+
+    # these checks only need the user id
+    user_dupe_character = User.user_dupe_character
+    owns_character = User.owns_character
+    has_spell_lists = User.has_spell_lists
+
 class Character(db.Model):
     '''DnD Character Model for users'''
 
@@ -126,6 +253,7 @@ class Character(db.Model):
         db.Integer,
         db.ForeignKey('users.id', ondelete='CASCADE'),
         nullable=False,
+        index=True,
     )
 
     name = db.Column(
@@ -133,11 +261,11 @@ class Character(db.Model):
         nullable=False,
     )
 
-    stats = db.relationship('Stats', uselist=False, cascade="all, delete, delete-orphan")
+    stats = db.relationship('Stats', uselist=False, cascade="all, delete, delete-orphan", passive_deletes=True)
 
-    classes = db.relationship('Char_Class', cascade="all, delete, delete-orphan")
+    classes = db.relationship('Char_Class', cascade="all, delete, delete-orphan", passive_deletes=True)
 
-    spell_lists = db.relationship('SpellList', cascade="all, delete-orphan", backref='char')
+    spell_lists = db.relationship('SpellList', cascade="all, delete-orphan", passive_deletes=True, backref='char')
 
     def get_classes(self):
         '''Returns a list of classes for this character
@@ -164,41 +292,33 @@ class Character(db.Model):
 
         return char
 
-    def get_class_spells(self):
-        '''Makes get request to API for a list of spell indexes that are available
-        to this class. Then we add those indexes to a set and move onto the next class
-        for that character.
-    
-        If no spells are available we return False, otherwise we return the set of spel
-        indexes.'''
-    
-        available_spells = set()
-        for _class in self.get_classes():
-            #make request to api for spells available to the current character class
-            results = requests.get(f'{base_url}/api/classes/{_class["class_name"]}/spells').json()['results']
-
-            #create a set of spell_indexes from the restults of the api call
-            new_spells = {result['index'] for result in results}
+    def get_spell_slots(self):
+        '''Returns a list of spellcasting dicts with available spell slots, one for
+        each class that can cast spells at the characters level'''
+        classes = self.get_classes()
 
-            #add the spells to the set of available spells
-            available_spells.update(new_spells)
+        #get level info for all of the characters classes from our mirror of the api in one query
+        levels = {(level.class_index, level.level): level for level in
+                  db.session.query(ClassLevel).filter(ClassLevel.class_index.in_([_class['class_name'] for _class in classes]))}
 
-        if len(available_spells) == 0:
-            return None
-        else:
-            return available_spells
+        #fall back to the (cached) api for classes the mirror hasn't been seeded for
+        api_levels = get_unseeded_class_json([_class['class_name'] for _class in classes], 'levels',
+                                             seeded={class_index for class_index, level in levels})
 
-    def get_spell_slots(self):
-        '''Returns a dict with available spell slots'''
         slots=[]
-        for _class in self.get_classes():
-            #api call to get level info by character class
-            resp = requests.get(f"{base_url}/api/classes/{_class['class_name']}/levels").json()
-
-            #loop through api response to find level info for character level
-            for item in resp:
-                if item['level'] == _class['level'] and 'spellcasting' in item:
-                    slots.append(item['spellcasting'])
+        for _class in classes:
+            level = levels.get((_class['class_name'], _class['level']))
+
+            if level:
+                spellcasting = level.spellcasting
+            else:
+                #loop through api response to find level info for character level
+                spellcasting = next((item.get('spellcasting') for item in api_levels.get(_class['class_name'], [])
+                                     if item['level'] == _class['level'] and 'subclass' not in item), None)
+
+            if spellcasting:
+                # copy the dict, get_highest_spell_level renames keys in place
+                slots.append(dict(spellcasting))
     
         return slots
 
@@ -227,13 +347,25 @@ class Character(db.Model):
     
     def get_spells_from_db(self, slots):
         '''Get all available spell objects from db'''
-        # query api for index of spells for characters classes
-        spells = self.get_class_spells()
-
         highest_spell_level = self.get_highest_spell_level(slots)
 
-        #get all spells from our database that have a level less than or equal to the highest level spell slot
-        spell_objects = (db.session.query(Spell).filter(Spell.level <= highest_spell_level, Spell.index.in_(spells))
+        #a spell is available if it is on the class spell list of any of the characters classes
+        available = (db.select(ClassSpell.id)
+                        .join(Classes, Classes.index == ClassSpell.class_index)
+                        .join(Char_Class, Char_Class.class_id == Classes.id)
+                        .where(Char_Class.char_id == self.id, ClassSpell.spell_index == Spell.index)
+                        .exists())
+
+        #fall back to the (cached) api for classes the mirror hasn't been seeded for, like get_spell_slots
+        api_spells = get_unseeded_class_json([_class['class_name'] for _class in self.get_classes() or []], 'spells',
+                                             seeded=catalog.seeded_class_spells())
+
+        if api_spells:
+            available = db.or_(available, Spell.index.in_({result['index'] for resp in api_spells.values()
+                                                           for result in resp['results']}))
+
+        #get all available spells from our database that have a level less than or equal to the highest level spell slot
+        spell_objects = (db.session.query(Spell).filter(Spell.level <= highest_spell_level, available)
                             .order_by(Spell.level, Spell.name))
         
         return spell_objects
@@ -353,6 +485,83 @@ class Subclasses(db.Model):
         nullable=False
     )
 
+class CatalogVersion(db.Model):
+    '''Single row table holding the version of the api data. The seeder
+    bumps it whenever it loads api data, so app processes know to clear
+    their in-process catalog caches'''
+
+    __tablename__ = 'catalog_version'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+
+    version = db.Column(
+        db.BigInteger,
+        nullable=False,
+        default=0
+    )
+
+class ClassSpell(db.Model):
+    '''Mirror of the api class spell lists, tracks which spells
+    are available to each character class'''
+
+    __tablename__ = 'class_spells'
+
+    __table_args__ = (
+        db.Index('ix_class_spells_class_index_spell_index', 'class_index', 'spell_index'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+
+    class_index = db.Column(
+        db.String,
+        db.ForeignKey('classes.index', ondelete='CASCADE'),
+        nullable=False
+    )
+
+    # not a foreign key, the spell list for a class is kept by api index
+    # so it does not depend on the spells table being loaded
+    spell_index = db.Column(
+        db.String,
+        nullable=False
+    )
+
+class ClassLevel(db.Model):
+    '''Mirror of the api class level tables, tracks the spellcasting
+    info (cantrips known, spell slots) for each class at each level'''
+
+    __tablename__ = 'class_levels'
+
+    __table_args__ = (
+        db.Index('ix_class_levels_class_index_level', 'class_index', 'level'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+
+    class_index = db.Column(
+        db.String,
+        db.ForeignKey('classes.index', ondelete='CASCADE'),
+        nullable=False
+    )
+
+    level = db.Column(
+        db.Integer,
+        nullable=False
+    )
+
+    # None for classes that can't cast spells at this level
+    spellcasting = db.Column(
+        db.JSON
+    )
+
 class Char_Class(db.Model):
     '''Join table to track characters class, subclass, and level'''
 
@@ -365,7 +574,8 @@ class Char_Class(db.Model):
 
     char_id = db.Column(
         db.Integer,
-        db.ForeignKey('characters.id', ondelete='CASCADE')
+        db.ForeignKey('characters.id', ondelete='CASCADE'),
+        index=True
     )
 
     class_id = db.Column(
@@ -386,9 +596,9 @@ class Char_Class(db.Model):
     class_name = db.relationship('Classes')
 
 class Spell(db.Model):
-    '''Table of available spells. We save certain info in the database,
-    the rest of the data we can make an AJAX request on front-end to retrieve.
-    This is everything we want to save on the backend and display on the spell list page'''
+    '''Table of available spells. The columns up to school are displayed on the
+    spell cards, the detail columns are served by the /api/spells endpoint when a
+    spell card is expanded on the front-end'''
 
     __tablename__ = 'spells'
 
@@ -424,7 +634,8 @@ class Spell(db.Model):
     )
 
     level = db.Column(
-        db.Integer
+        db.Integer,
+        index=True
     )
 
     damaging = db.Column(
@@ -439,6 +650,39 @@ class Spell(db.Model):
         db.String
     )
 
+    # api desc paragraphs, separated by newlines
+    description = db.Column(
+        db.Text
+    )
+
+    higher_level = db.Column(
+        db.Text
+    )
+
+    components = db.Column(
+        db.String
+    )
+
+    material = db.Column(
+        db.Text
+    )
+
+    ritual = db.Column(
+        db.Boolean
+    )
+
+    attack_type = db.Column(
+        db.String
+    )
+
+    damage_type = db.Column(
+        db.String
+    )
+
+    area_of_effect = db.Column(
+        db.String
+    )
+
     def serialize_self(self):
         return {
             'name': self.name,
@@ -452,6 +696,34 @@ class Spell(db.Model):
             'school': self.school
         }
 
+    def serialize_summary(self):
+        '''Returns a dict of the fields the spell list builder sorts and filters cards by'''
+        return {
+            'id': self.id,
+            'index': self.index,
+            'name': self.name,
+            'level': self.level,
+            'school': self.school,
+            'damaging': self.damaging,
+            'healing': self.healing,
+            'concentration': self.concentration
+        }
+
+    def serialize_details(self):
+        '''Returns a dict of the details shown on an expanded spell card'''
+        return {
+            'id': self.id,
+            'index': self.index,
+            'desc': self.description.split('\n') if self.description else [],
+            'higher_level': self.higher_level,
+            'components': self.components,
+            'material': self.material,
+            'ritual': self.ritual,
+            'attack_type': self.attack_type,
+            'damage_type': self.damage_type,
+            'area_of_effect': self.area_of_effect
+        }
+
 class SpellList(db.Model):
     '''Table of spell lists made by users with their characters'''
 
@@ -464,7 +736,8 @@ class SpellList(db.Model):
 
     char_id = db.Column(
         db.Integer,
-        db.ForeignKey('characters.id', ondelete='CASCADE')
+        db.ForeignKey('characters.id', ondelete='CASCADE'),
+        index=True
     )
 
     name = db.Column(
@@ -478,7 +751,7 @@ class SpellList(db.Model):
         default=datetime.utcnow()
     )
 
-    spells = db.relationship('Spell', secondary="spell_list_spells", backref='spell_lists')
+    spells = db.relationship('Spell', secondary="spell_list_spells", passive_deletes=True, backref='spell_lists')
 
     spell_list_spells = db.relationship('SpellListSpells', cascade='all, delete, delete-orphan', passive_deletes=True, overlaps="spell_lists, spells")
 
@@ -487,6 +760,10 @@ class SpellListSpells(db.Model):
 
     __tablename__ = 'spell_list_spells'
 
+    __table_args__ = (
+        db.Index('ix_spell_list_spells_list_id_spell_id', 'list_id', 'spell_id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -1,60 +1,337 @@
+'''Seed the database with classes, subclasses and spells from the dnd5eapi.
+
+    python seed.py                  drop all tables and seed from scratch
+    python seed.py --refresh        apply pending migrations and update the api data
+                                    in place, keeping users, characters and spell lists
+    python seed.py --export PATH    save the api data to a snapshot file
+    python seed.py --snapshot PATH  seed (or --refresh) from a snapshot file
+                                    instead of the api, no network needed
+    python seed.py --benchmark      compare ORM and bulk insert times for spells
+'''
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
 import requests
-from sqlalchemy import insert
+from sqlalchemy import insert, update
+
+import catalog
+import migrations
+from app import app, db
+from dnd_api import ApiClient
+from models import Classes, Subclasses, Spell, ClassSpell, ClassLevel
+
+# number of api requests the seeder makes at the same time
+SEED_CONCURRENCY = int(os.environ.get('SEED_CONCURRENCY', 10))
+
+# number of times each request is retried after it fails
+SEED_RETRIES = int(os.environ.get('SEED_RETRIES', 3))
+
+# bumped whenever the layout of the snapshot file changes
+SNAPSHOT_FORMAT = 'spell-tracker-srd'
+SNAPSHOT_VERSION = 1
+
+# The seeder's own api client, with a pooled connection for each concurrent request.
+# fetch_with_retry is the only retry loop, and there is no circuit breaker, which would
+# fail every remaining request without trying the api while it waits out its cooldown
+client = ApiClient(pool_size=SEED_CONCURRENCY,
+                   connect_timeout=app.config['DND_API_CONNECT_TIMEOUT'],
+                   read_timeout=app.config['DND_API_READ_TIMEOUT'],
+                   retries=0,
+                   breaker_threshold=None)
+
+def fetch_with_retry(path, retries=SEED_RETRIES):
+    '''Make an api request, retrying the whole request with backoff if it fails'''
+    for attempt in range(retries + 1):
+        try:
+            return client.get_json(path)
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
 
-from app import db
-from models import Classes, Subclasses, Spell
+def fetch_all(paths, label, concurrency=SEED_CONCURRENCY):
+    '''Fetch a list of api paths, `concurrency` requests at a time.
 
-db.drop_all()
-db.create_all()
+    Returns the json responses in the same order as paths and
+    reports progress as the requests finish.'''
 
-def seed_db_classes():
-    resp = requests.get('https://www.dnd5eapi.co/api/classes')
+    results = [None] * len(paths)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fetch_with_retry, path): i for i, path in enumerate(paths)}
+
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            print(f'\rFetching {label}: {done}/{len(paths)}', end='', file=sys.stderr)
+
+    print(file=sys.stderr)
+    return results
+
+def fetch_classes():
+    '''Returns rows for the classes table and the subclasses table'''
+    class_list = [{'index': _class['index'], 'name': _class['name'], 'url': _class['url']}
+                  for _class in client.get_json('/api/classes')['results']]
+
+    responses = fetch_all([f'/api/classes/{_class["index"]}/subclasses' for _class in class_list], 'subclasses')
 
-    class_list = resp.json()['results']
     subclass_list = []
-    i = 0
-    for _class in class_list:
-        resp = requests.get(f'https://www.dnd5eapi.co/api/classes/{_class["index"]}/subclasses')
-        subclass_list.append(resp.json()['results'][0])
-        subclass_list[i]['parent_class'] = _class['index']
-        i += 1
-
-    db.session.execute(insert(Classes), class_list)
-    db.session.execute(insert(Subclasses), subclass_list)
-    db.session.commit()
+    for _class, resp in zip(class_list, responses):
+        subclass = resp['results'][0]
+        subclass_list.append({'index': subclass['index'], 'name': subclass['name'],
+                              'url': subclass['url'], 'parent_class': _class['index']})
 
-def seed_db_spells():
-    # classes = db.session.query(Classes).all()
+    return class_list, subclass_list
 
-    #get the list of spells from the API
-    resp = requests.get('https://www.dnd5eapi.co/api/spells')
+def fetch_spells():
+    '''Returns the full api response for every spell'''
 
+    #get the list of spells from the API
     #returns an array of dicts with spell names and url for individual request
-    all_spells = resp.json()['results']
-
-    #we will use this to store the spells from our loop
-    spell_list = []
-
-    for url in [spell['url'] for spell in all_spells]:
-        resp = requests.get(f'https://www.dnd5eapi.co{url}').json()
-
-        if 'damage' in resp.keys():
-            spell = Spell(index=resp['index'], name=resp['name'], range=resp['range'],
-                    duration=resp['duration'], concentration=resp['concentration'], casting_time=resp['casting_time'],
-                    level=resp['level'], damaging=True, healing=False, school=resp['school']['name'])
-        elif 'heal_at_slot_level' in resp.keys():
-            spell = Spell(index=resp['index'], name=resp['name'], range=resp['range'],
-                    duration=resp['duration'], concentration=resp['concentration'], casting_time=resp['casting_time'],
-                    level=resp['level'], healing=True, damaging=False, school=resp['school']['name'])
+    all_spells = client.get_json('/api/spells')['results']
+
+    return fetch_all([spell['url'] for spell in all_spells], 'spells')
+
+def fetch_class_spells(class_indexes):
+    '''Returns rows for the class_spells table'''
+    responses = fetch_all([f'/api/classes/{index}/spells' for index in class_indexes], 'class spell lists')
+
+    class_spell_list = []
+    for index, resp in zip(class_indexes, responses):
+        for spell in resp['results']:
+            class_spell_list.append({'class_index': index, 'spell_index': spell['index']})
+
+    return class_spell_list
+
+def fetch_class_levels(class_indexes):
+    '''Returns rows for the class_levels table'''
+    responses = fetch_all([f'/api/classes/{index}/levels' for index in class_indexes], 'class levels')
+
+    class_level_list = []
+    for index, resp in zip(class_indexes, responses):
+        for level in resp:
+            # subclass specific levels don't change spell slots
+            if 'subclass' in level:
+                continue
+
+            class_level_list.append({'class_index': index, 'level': level['level'],
+                                     'spellcasting': level.get('spellcasting')})
+
+    return class_level_list
+
+def spell_row(resp):
+    '''Returns a row for the spells table from an api spell response'''
+    return {
+        'index': resp['index'],
+        'name': resp['name'],
+        'range': resp['range'],
+        'duration': resp['duration'],
+        'concentration': resp['concentration'],
+        'casting_time': resp['casting_time'],
+        'level': resp['level'],
+        'damaging': 'damage' in resp,
+        'healing': 'damage' not in resp and 'heal_at_slot_level' in resp,
+        'school': resp['school']['name'],
+        'description': '\n'.join(resp.get('desc', [])),
+        'higher_level': ' '.join(resp.get('higher_level', [])) or None,
+        'components': ', '.join(resp.get('components', [])),
+        'material': resp.get('material'),
+        'ritual': resp.get('ritual', False),
+        'attack_type': resp.get('attack_type'),
+        'damage_type': resp.get('damage', {}).get('damage_type', {}).get('name'),
+        'area_of_effect': (f"{resp['area_of_effect']['size']} ft. {resp['area_of_effect']['type']}"
+                           if 'area_of_effect' in resp else None)
+    }
+
+def fetch_srd():
+    '''Fetch everything the app uses from the api.
+
+    Returns a dict with rows for the classes, subclasses, class_spells and
+    class_levels tables, and the full api response for every spell.'''
+
+    class_list, subclass_list = fetch_classes()
+    class_indexes = [_class['index'] for _class in class_list]
+
+    return {
+        'classes': class_list,
+        'subclasses': subclass_list,
+        'spells': fetch_spells(),
+        'class_spells': fetch_class_spells(class_indexes),
+        'class_levels': fetch_class_levels(class_indexes)
+    }
+
+def write_snapshot(data, path):
+    '''Save api data from fetch_srd to a gzipped json snapshot file'''
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.utcnow().isoformat(),
+        **data
+    }
+
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+
+    print(f"Saved {len(data['spells'])} spells and {len(data['classes'])} classes to {path}")
+
+def read_snapshot(path):
+    '''Load api data saved by write_snapshot'''
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        snapshot = json.load(f)
+
+    if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} {SNAPSHOT_FORMAT} snapshot")
+
+    return {table: snapshot[table] for table in ['classes', 'subclasses', 'spells', 'class_spells', 'class_levels']}
+
+def content_hash(row):
+    '''Returns a hash of a rows column values'''
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode()).hexdigest()
+
+def upsert_rows(model, rows, key=('index',), delete_missing=False):
+    '''Insert new rows into the models table and update the existing rows
+    whose content has changed, matching rows on the `key` columns.
+
+    Rows in the table that are missing from `rows` are only removed when
+    delete_missing is set, so spells in users lists are never deleted.
+
+    Returns a dict with the number of inserted, updated, unchanged and deleted rows.'''
+
+    existing = {tuple(getattr(obj, col) for col in key): obj for obj in db.session.query(model)}
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+
+    new_rows = []
+    changed_rows = []
+    seen = set()
+    for row in rows:
+        row_key = tuple(row[col] for col in key)
+        seen.add(row_key)
+        obj = existing.get(row_key)
+
+        if obj is None:
+            new_rows.append(row)
+            counts['inserted'] += 1
+
+        elif content_hash({col: getattr(obj, col) for col in row}) != content_hash(row):
+            changed_rows.append({'id': obj.id, **row})
+            counts['updated'] += 1
+
         else:
-            spell = Spell(index=resp['index'], name=resp['name'], range=resp['range'],
-                    duration=resp['duration'], concentration=resp['concentration'], casting_time=resp['casting_time'],
-                    healing=False, damaging=False, level=resp['level'], school=resp['school']['name'])
-        
-        spell_list.append(spell)
+            counts['unchanged'] += 1
+
+    if delete_missing:
+        missing_ids = [obj.id for row_key, obj in existing.items() if row_key not in seen]
+        if missing_ids:
+            db.session.query(model).filter(model.id.in_(missing_ids)).delete(synchronize_session=False)
+        counts['deleted'] = len(missing_ids)
+
+    # one executemany each for the new and changed rows
+    if new_rows:
+        db.session.execute(insert(model), new_rows)
+
+    if changed_rows:
+        db.session.execute(update(model), changed_rows)
+
+    return counts
 
-    db.session.add_all(spell_list)
+def refresh_db(data):
+    '''Bring the schema up to date and update the api data in place
+    without touching user data'''
+
+    # only creates tables that don't exist yet, then add the columns and
+    # indexes from migrations.py to tables made before them
+    db.create_all()
+    migrations.upgrade()
+
+    report = {}
+    report['classes'] = upsert_rows(Classes, data['classes'])
+    report['subclasses'] = upsert_rows(Subclasses, data['subclasses'])
+    report['spells'] = upsert_rows(Spell, [spell_row(resp) for resp in data['spells']])
+    report['class spells'] = upsert_rows(ClassSpell, data['class_spells'],
+                                         key=('class_index', 'spell_index'), delete_missing=True)
+    report['class levels'] = upsert_rows(ClassLevel, data['class_levels'],
+                                         key=('class_index', 'level'), delete_missing=True)
+    db.session.commit()
+    catalog.bump_version()
+
+    for table, counts in report.items():
+        print(f"{table}: {counts['inserted']} inserted, {counts['updated']} updated, "
+              f"{counts['unchanged']} unchanged, {counts['deleted']} deleted")
+
+    return report
+
+def benchmark_spell_inserts(data, repeat=3):
+    '''Time seeding the spells table through the ORM unit of work
+    against the bulk Core insert the seeder uses.
+
+    The rows get a suffix so they don't collide with the seeded spells,
+    and every run is rolled back.'''
+
+    rows = [spell_row(resp) for resp in data['spells']]
+    for row in rows:
+        row['index'] += '-benchmark'
+        row['name'] += ' (benchmark)'
+
+    def orm_insert():
+        db.session.add_all([Spell(**row) for row in rows])
+        db.session.flush()
+
+    def core_insert():
+        db.session.execute(insert(Spell), rows)
+
+    for label, insert_rows in [('ORM add_all', orm_insert), ('Core insert', core_insert)]:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            insert_rows()
+            times.append(time.perf_counter() - start)
+            db.session.rollback()
+
+        print(f'{label}: {len(rows)} spells, best of {repeat}: {min(times) * 1000:.1f} ms')
+
+def seed_db(data):
+    '''Drop every table and seed the api data from scratch'''
+    db.drop_all()
+    db.create_all()
+
+    # one executemany per table
+    db.session.execute(insert(Classes), data['classes'])
+    db.session.execute(insert(Subclasses), data['subclasses'])
+    db.session.execute(insert(Spell), [spell_row(resp) for resp in data['spells']])
+    db.session.execute(insert(ClassSpell), data['class_spells'])
+    db.session.execute(insert(ClassLevel), data['class_levels'])
     db.session.commit()
+    catalog.bump_version()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed the Spell Tracker database from the dnd5eapi')
+    parser.add_argument('--refresh', action='store_true',
+                        help='update the api data in place instead of dropping every table')
+    parser.add_argument('--export', metavar='PATH',
+                        help='save the api data to a snapshot file instead of seeding')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='read the api data from a snapshot file instead of the api')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare ORM and bulk insert times for the spells table')
+    args = parser.parse_args()
+
+    if args.snapshot:
+        data = read_snapshot(args.snapshot)
+    else:
+        data = fetch_srd()
 
-seed_db_classes()
-seed_db_spells()
\ No newline at end of file
+    if args.export:
+        write_snapshot(data, args.export)
+    elif args.benchmark:
+        benchmark_spell_inserts(data)
+    elif args.refresh:
+        refresh_db(data)
+    else:
+        seed_db(data)
@@ -0,0 +1,120 @@
+"""In-memory search indexes over the spell catalog for Spell Tracker.
+
+Each spell gets a position in level and name order, and every filter is a
+bitmap (a python int) with a bit set for each spell that matches it.
+Searches AND the bitmaps together and read the set bits back in order, so
+results come out sorted without touching the database. The index is kept in
+the catalog cache and rebuilt when the catalog version changes.
+"""
+
+import re
+from bisect import bisect_left
+
+import catalog
+from models import db, Spell
+
+def tokenize(text):
+    '''Returns the lowercase words in text'''
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+class SpellIndex:
+    '''Bitmaps of the spells matching each level, school and flag, and of
+    the spells with each word in their name'''
+
+    def __init__(self, spells):
+        '''spells is a list of (id, name, level, school, damaging, healing,
+        concentration) tuples in level and name order'''
+        self.ids = []
+        self.positions = {}
+        self.levels = {}
+        self.schools = {}
+        self.flags = {'damaging': 0, 'healing': 0, 'concentration': 0}
+        self.tokens = {}
+
+        for position, (_id, name, level, school, damaging, healing, concentration) in enumerate(spells):
+            bit = 1 << position
+            self.ids.append(_id)
+            self.positions[_id] = position
+
+            self.levels[level] = self.levels.get(level, 0) | bit
+            if school:
+                self.schools[school.lower()] = self.schools.get(school.lower(), 0) | bit
+
+            for flag, value in (('damaging', damaging), ('healing', healing), ('concentration', concentration)):
+                if value:
+                    self.flags[flag] |= bit
+
+            for token in tokenize(name or ''):
+                self.tokens[token] = self.tokens.get(token, 0) | bit
+
+        # sorted so every token starting with a prefix is one contiguous run
+        self.sorted_tokens = sorted(self.tokens)
+
+    def bitmap(self, ids):
+        '''Returns the bitmap of the given spell ids, ids that aren't in the
+        index are left out'''
+        bits = 0
+        for _id in ids:
+            if _id in self.positions:
+                bits |= 1 << self.positions[_id]
+        return bits
+
+    def name_bitmap(self, text):
+        '''Returns the bitmap of spells with a word in their name starting
+        with each word in text, e.g. "cure wou" matches Cure Wounds'''
+        bits = (1 << len(self.ids)) - 1
+
+        for prefix in tokenize(text):
+            matches = 0
+            i = bisect_left(self.sorted_tokens, prefix)
+            while i < len(self.sorted_tokens) and self.sorted_tokens[i].startswith(prefix):
+                matches |= self.tokens[self.sorted_tokens[i]]
+                i += 1
+            bits &= matches
+
+        return bits
+
+    def search(self, available, name=None, level=None, school=None, damaging=False, healing=False, concentration=False):
+        '''Returns the ids of the available spells matching every given filter,
+        in level and name order'''
+        bits = available
+
+        if name:
+            bits &= self.name_bitmap(name)
+        if level is not None:
+            bits &= self.levels.get(level, 0)
+        if school:
+            bits &= self.schools.get(school.lower(), 0)
+
+        for flag, wanted in (('damaging', damaging), ('healing', healing), ('concentration', concentration)):
+            if wanted:
+                bits &= self.flags[flag]
+
+        ids = []
+        while bits:
+            lowest = bits & -bits
+            ids.append(self.ids[lowest.bit_length() - 1])
+            bits ^= lowest
+
+        return ids
+
+def spell_index():
+    '''Returns the search index for the current catalog version'''
+    return catalog.cached('spell_index', lambda: SpellIndex(
+        db.session.query(Spell.id, Spell.name, Spell.level, Spell.school,
+                         Spell.damaging, Spell.healing, Spell.concentration)
+                  .order_by(Spell.level, Spell.name).all()))
+
+def search_spells(available_ids, **filters):
+    '''Returns the ids of the available spells matching the filters, in
+    level and name order, see SpellIndex.search for the filters'''
+    available_ids = list(available_ids)
+    index = spell_index()
+
+    # spells added without bumping the catalog version aren't in the index yet,
+    # rebuild it rather than leaving them out of the results
+    if any(_id not in index.positions for _id in available_ids):
+        catalog.invalidate()
+        index = spell_index()
+
+    return index.search(index.bitmap(available_ids), **filters)
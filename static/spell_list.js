@@ -5,93 +5,267 @@ const $userTip = $("#user-tip")
 const $filter = $('#filter-button')
 const $reset = $('#reset-button')
 
-// spell options in the hidden multiple select field
-const spellOptions = document.querySelectorAll("option")
 // select field for form
 const formSelectField = document.getElementById("spells");
 
-const base_url = 'https://www.dnd5eapi.co'
+// height used for a card until it has been rendered and measured
+const CARD_HEIGHT = 120
+// height of cards rendered above and below the visible part of the list
+const OVERSCAN = 600
+
+// spells available to the character in level and name order, loaded a page at a time
+let spells = []
+const spellsById = new Map()
+let nextPage = {}
+let loadingPage = null
+
+// cards currently rendered in the available spells list, and the measured height of every card
+const cards = new Map()
+const heights = new Map()
+
+// ids of the spells dragged to the spell list
+const inList = new Set()
+
+// ids of the available spells matching the filters in order, null when not filtering
+let filteredIds = null
+let searchCount = 0
+let searchTimer = null
+
+// spacers standing in for the cards above and below the rendered ones
+const topSpacer = document.createElement("div")
+const bottomSpacer = document.createElement("div")
+
+function loadPage() {
+    // get the next page of available spells, if there is one and it isn't already loading
+    if (!loadingPage && nextPage) {
+        loadingPage = axios.get(spellContainer.dataset.spellsUrl, { params: nextPage })
+            .then(resp => {
+                spells.push(...resp.data.spells)
+                resp.data.spells.forEach(spell => spellsById.set(spell.id, spell))
+                nextPage = resp.data.next
+                loadingPage = null
+                renderWindow()
+            }, err => {
+                loadingPage = null
+                throw err
+            })
+    }
+    return loadingPage
+}
+
+// ids of spells being fetched for search results that weren't loaded
+const fetching = new Set()
+
+function loadSpells(ids) {
+    // get the cards for search results outside the loaded pages, one request per window
+    ids = ids.filter(id => !fetching.has(id))
+
+    if (ids.length) {
+        ids.forEach(id => fetching.add(id))
+
+        axios.get(spellContainer.dataset.spellsUrl, { params: { ids: ids.join(',') } })
+            .then(resp => {
+                resp.data.spells.forEach(spell => spellsById.set(spell.id, spell))
+
+                // drop results that are no longer available so they aren't requested again
+                if (filteredIds) {
+                    filteredIds = filteredIds.filter(id => spellsById.has(id) || !ids.includes(id))
+                }
+                renderWindow()
+            })
+            .finally(() => ids.forEach(id => fetching.delete(id)))
+    }
+}
+
+function getCard(spell) {
+    // build a card from the spells pre-rendered html the first time it is shown
+    if (!cards.has(spell.id)) {
+        const card = document.createElement("div")
+        card.className = "card spell-card small"
+        card.id = spell.id
+        card.draggable = true
+        card.dataset.spellIndex = spell.index
+        card.dataset.level = spell.level
+        card.innerHTML = spell.card
+
+        cards.set(spell.id, card)
+    }
+    return cards.get(spell.id)
+}
+
+function renderWindow(remeasure = true) {
+    // render only the cards in or near the visible part of the list,
+    // with spacers keeping the scroll height of the cards that aren't rendered
+    const matching = filteredIds || spells.map(spell => spell.id)
+    const available = matching.filter(id => !inList.has(id))
+
+    const top = spellContainer.scrollTop - OVERSCAN
+    const bottom = spellContainer.scrollTop + spellContainer.clientHeight + OVERSCAN
+
+    let offset = 0
+    let before = 0
+    let windowHeight = 0
+    const rendered = []
+    const missing = []
+
+    for (let id of available) {
+        const height = heights.get(id) || CARD_HEIGHT
+
+        if (offset + height < top) {
+            before += height
+        }
+        else if (offset <= bottom) {
+            if (spellsById.has(id)) {
+                rendered.push(getCard(spellsById.get(id)))
+            }
+            else {
+                // search results outside the loaded pages hold their place until their card arrives
+                missing.push(id)
+                rendered.push(placeholder(height))
+            }
+            windowHeight += height
+        }
+        offset += height
+    }
+
+    topSpacer.style.height = `${before}px`
+    bottomSpacer.style.height = `${offset - before - windowHeight}px`
+
+    spellContainer.replaceChildren(topSpacer, ...rendered, bottomSpacer)
+
+    if (missing.length) {
+        loadSpells(missing)
+    }
+
+    // forget collapsed cards that scrolled out of the window, they are rebuilt when they come back
+    for (let [id, card] of cards) {
+        if (!card.isConnected && card.classList.contains('small')) {
+            cards.delete(id)
+        }
+    }
+
+    // measure the rendered cards and render again if the estimates were off
+    let changed = false
+    for (let card of rendered) {
+        if (card.id && heights.get(Number(card.id)) !== card.offsetHeight) {
+            heights.set(Number(card.id), card.offsetHeight)
+            changed = true
+        }
+    }
+
+    if (changed && remeasure) {
+        renderWindow(false)
+    }
+    else if (nextPage && !filteredIds && offset < bottom) {
+        // get more spells when scrolling near the end of the loaded ones
+        loadPage()
+    }
+}
+
+function placeholder(height) {
+    const elem = document.createElement("div")
+    elem.style.height = `${height}px`
+    return elem
+}
+
+let frameRequested = false
+
+function handleScroll() {
+    // render at most once per frame while scrolling
+    if (!frameRequested) {
+        frameRequested = true
+        requestAnimationFrame(() => {
+            frameRequested = false
+            renderWindow()
+        })
+    }
+}
 
 function allowDrop(evt) {
     evt.preventDefault();
 }
 
 function drag(evt) {
-    evt.dataTransfer.setData("text", evt.target.id);
+    let spellCard = evt.target.closest('.spell-card')
+
+    if (spellCard) {
+        evt.dataTransfer.setData("text", spellCard.id);
+    }
+}
+
+function selectOption(spellId, selected) {
+    // add or remove the spell in the hidden select field, it only has options for the spells in the list
+    if (selected) {
+        formSelectField.add(new Option(spellId, spellId, true, true))
+    }
+    else {
+        formSelectField.querySelector(`option[value="${spellId}"]`)?.remove()
+    }
 }
 
 function addToListOnDrop(evt) {
     evt.preventDefault();
     let data = evt.dataTransfer.getData("text");
+    let spellCard = document.getElementById(data)
 
-    // find the spell that was added to the list
-    let addedSpell = Array.from(spellOptions).find(spell => spell.value == data)
+    if (!spellCard || dropZone.contains(spellCard)) {
+        return
+    }
 
-    // set the spell in the hidden select field to true
-    addedSpell.selected = true;
+    selectOption(data, true)
+    inList.add(Number(data))
+    cards.delete(Number(data))
 
-    dropZone.appendChild(document.getElementById(data));
+    dropZone.appendChild(spellCard);
 
+    renderWindow()
     toggleDropZone()
 }
 
 function returnToSpellsOnDrop(evt) {
     evt.preventDefault();
     let data = evt.dataTransfer.getData("text");
+    let spellCard = document.getElementById(data)
 
-    // find the spell that was added to the list
-    let addedSpell = Array.from(spellOptions).find(spell => spell.value == data)
-
-    // set the spell in the hidden select field to true
-    addedSpell.selected = false;
-
-    spellContainer.appendChild(document.getElementById(data));
-
-    //make an array of all spells
-    let spellArray = Array.from(spellContainer.children).sort(compare);
+    if (!spellCard || !dropZone.contains(spellCard)) {
+        return
+    }
 
-    //append sorted list back to DOM
-    spellArray.forEach(elem => spellContainer.appendChild(elem));
+    selectOption(data, false)
+    returnCard(spellCard)
 
+    // the card is rendered back in its place in the available spells
+    renderWindow()
     toggleDropZone()
 }
 
-function compare(a, b) {
-    if (parseInt(a.dataset.listPosition) < parseInt(b.dataset.listPosition))
-        return -1;
-    if (parseInt(a.dataset.listPosition) > parseInt(b.dataset.listPosition))
-        return 1;
-    return 0;
+function returnCard(spellCard) {
+    inList.delete(Number(spellCard.id))
+    cards.set(Number(spellCard.id), spellCard)
+    spellCard.remove()
 }
 
-// Function to sort spells
 function clearSpellList(evt) {
 
     evt.preventDefault();
 
-    // get all spells
-    const allSpellCards = document.querySelectorAll("[data-list-position]");
-
-    //make an array of all spells
-    let spellArray = Array.from(allSpellCards).sort(compare);
-
-    //append sorted list back to DOM
-    spellArray.forEach(elem => spellContainer.appendChild(elem));
+    // move all spells in the list back to the available spells
+    dropZone.querySelectorAll(".spell-card").forEach(returnCard)
 
     //clear options
-    Array.from(spellOptions).forEach(elem => elem.selected = false)
+    formSelectField.replaceChildren()
 
-    //reset drop-zone class
+    renderWindow()
     toggleDropZone()
 }
 
 function toggleDropZone() {
-    if (dropZone.childElementCount === 0) {
+    if (inList.size === 0) {
         dropZone.classList.remove('has-items');
         dropZone.classList.add('empty-list');
         $userTip.show()
     }
-    else if (dropZone.childElementCount > 0) {
+    else {
         dropZone.classList.remove('empty-list');
         dropZone.classList.add('has-items');
         $userTip.hide()
@@ -99,20 +273,41 @@ function toggleDropZone() {
 }
 
 let origHTML = {};
+let spellDetails = {};
+
+function getSpellDetails(spellId) {
+    // request the details for every loaded spell that doesn't have them yet in one request,
+    // the first time one of their cards is expanded
+    if (!spellDetails[spellId]) {
+        const ids = Array.from(spellsById.keys()).filter(id => !spellDetails[id])
+
+        const details = axios.get('/api/spells', { params: { ids: ids.join(',') } })
+            .then(resp => Object.fromEntries(resp.data.spells.map(spell => [spell.id, spell])))
+
+        ids.forEach(id => spellDetails[id] = details.then(byId => byId[id]))
+    }
+    return spellDetails[spellId]
+}
+
 async function handleCardClick(evt) {
     // get spell card
-    spellCard = evt.target.closest('.spell-card')
-    spellIndex = spellCard.dataset.spellIndex
+    let spellCard = evt.target.closest('.spell-card')
+
+    if (!spellCard) {
+        return
+    }
+
+    let spellIndex = spellCard.dataset.spellIndex
 
     if (spellCard.classList.contains('small')) {
         // keep initial html for spell card in variable
         origHTML[spellIndex] = spellCard.innerHTML
 
-        //make request to api for spell info
-        json = await axios.get(`${base_url}/api/spells/${spellIndex}`)
+        //get spell info from our server
+        let details = await getSpellDetails(Number(spellCard.id))
 
         //update spellCard with new data
-        updateSpellCard(spellCard, json.data)
+        updateSpellCard(spellCard, details)
 
     }
     else if (spellCard.classList.contains('large')) {
@@ -123,21 +318,24 @@ async function handleCardClick(evt) {
     //toggle spell card class for css styling
     spellCard.classList.toggle('small')
     spellCard.classList.toggle('large')
+
+    // the card changed height
+    if (spellContainer.contains(spellCard)) {
+        renderWindow()
+    }
 }
 
 function updateSpellCard(spell, data) {
     //card is html, spell is json data
 
-    let { components, desc, higher_level, material, ritual, area_of_effect, attack_type, damage } = data
+    let { components, desc, higher_level, material, ritual, area_of_effect, attack_type, damage_type } = data
 
     let cardBody = spell.querySelector('.card-body');
 
-    cardBody.innerHTML += (`<p>Components: ${components.join(', ')}</p> <p>Description: ${desc.join(" <br> ")}</p>`)
+    cardBody.innerHTML += (`<p>Components: ${components}</p> <p>Description: ${desc.join(" <br> ")}</p>`)
 
-    if (damage) {
-        if ('damage_type' in damage) {
-            cardBody.innerHTML += (`<p>Damage Type: ${damage.damage_type.name}`)
-        }
+    if (damage_type) {
+        cardBody.innerHTML += (`<p>Damage Type: ${damage_type}`)
     }
 
     if (attack_type) {
@@ -145,14 +343,14 @@ function updateSpellCard(spell, data) {
     }
 
     if (area_of_effect) {
-        cardBody.innerHTML += `<p>Area of Effect: ${area_of_effect.size} ft. ${area_of_effect.type}</p>`
+        cardBody.innerHTML += `<p>Area of Effect: ${area_of_effect}</p>`
     }
 
     if (material) {
         cardBody.innerHTML += `<p>Material: ${material}</p>`
     }
 
-    if (higher_level.length > 0) {
+    if (higher_level) {
         cardBody.innerHTML += `<p>Higher Level: ${higher_level}</p>`
     }
 
@@ -161,66 +359,54 @@ function updateSpellCard(spell, data) {
     }
 }
 
-function filterSpells(evt) {
-    evt.preventDefault();
-
-    //loop through spell containter
-    let spellCards = Array.from(spellContainer.children);
+// search params for each filter input
+const filterParams = { 'search': 'name', 'level-input': 'level', 'damage': 'damaging', 'heal': 'healing', 'concentration': 'concentration' }
 
-    // hide all spells
-    spellCards.forEach(spellCard => $(spellCard).hide());
+async function filterSpells(evt) {
+    if (evt) {
+        evt.preventDefault();
+    }
 
     // get filter inputs user selected
-    let filter = {};
+    let params = {};
     for (let elem of $('#filter-form').serializeArray()) {
-        filter[elem.name] = elem.value;
-        if (filter[elem.name] == "on") {
-            filter[elem.name] = true;
-        }
-        if (filter[elem.name] == '') {
-            delete filter[elem.name];
+        if (elem.name in filterParams && elem.value != '') {
+            params[filterParams[elem.name]] = elem.value == "on" ? true : elem.value;
         }
     }
 
-    // if user wants to search by name
-    if (filter.search) {
-        spellCards = spellCards.filter(spellCard => {
-            if (spellCard.innerHTML.toLowerCase().includes(filter.search.toLowerCase())) {
-                return true
-            }
-        })
-    }
+    // ignore the results of searches that finish after a newer one started
+    const search = ++searchCount
 
-    // if user wants to filter by level
-    if (filter['level-input']) {
-        spellCards = spellCards.filter(spellCard => {
-            if (spellCard.dataset.level == filter['level-input']){
-                return true
-            }
-        })
+    if (Object.keys(params).length === 0) {
+        filteredIds = null
     }
+    else {
+        // the server returns the matching ids in order, cards that aren't
+        // loaded yet are fetched as they scroll into view
+        const resp = await axios.get(`${spellContainer.dataset.spellsUrl}/search`, { params })
 
-    for (let key of Object.keys(filter)) {
-        // if user wants to filter by concentration, damage, or healing
-        if (key && key != 'search' && key != 'level-input')
-            spellCards = spellCards.filter(spellCard => {
-                if (spellCard.innerHTML.includes(key)) {
-                    return true
-                }
-            })
+        if (search !== searchCount) {
+            return
+        }
+        filteredIds = resp.data.ids
     }
 
-    // show the DOM elements that meet the criteria
-    spellCards.forEach(spellCard => $(spellCard).show())
+    spellContainer.scrollTop = 0
+    renderWindow()
 }
 
-function resetAvailSpells() {
-    //loop through spell containter
-    let spellCards = Array.from(spellContainer.children);
+function searchAsYouType() {
+    // search once the user stops typing
+    clearTimeout(searchTimer)
+    searchTimer = setTimeout(filterSpells, 200)
+}
 
-    for (let spellCard of spellCards) {
-        $(spellCard).show()
-    }
+function resetAvailSpells() {
+    searchCount++
+    clearTimeout(searchTimer)
+    filteredIds = null
+    renderWindow()
 }
 
 function clearFilters() {
@@ -233,30 +419,29 @@ function clearFilters() {
 
 function start() {
 
-    // hide the select field with all spell options
+    // hide the select field with the spells in the list
     formSelectField.hidden = true;
 
-    // get all spell cards
-    const spellCards = spellContainer.children
-
-    for (card of spellCards) {
-        card.addEventListener("dragstart", drag);
-        card.addEventListener("click", handleCardClick)
+    // one listener for every card in each area
+    for (let area of [spellContainer, dropZone]) {
+        area.addEventListener("dragstart", drag)
+        area.addEventListener("click", handleCardClick)
+        area.addEventListener("dragover", allowDrop)
     }
 
-    dropZone.addEventListener("dragover", allowDrop)
     dropZone.addEventListener("drop", addToListOnDrop)
-
-    spellContainer.addEventListener("dragover", allowDrop)
     spellContainer.addEventListener("drop", returnToSpellsOnDrop)
+    spellContainer.addEventListener("scroll", handleScroll)
 
     const clearButton = document.getElementById('clear-button')
     clearButton.addEventListener("click", clearSpellList)
 
     $filter.click(filterSpells)
+    $('#search').on('input', searchAsYouType)
     $reset.click(resetAvailSpells)
     $reset.click(clearFilters)
 
+    loadPage()
 }
 
-window.addEventListener("DOMContentLoaded", start)
\ No newline at end of file
+window.addEventListener("DOMContentLoaded", start)
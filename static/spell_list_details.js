@@ -1,7 +1,20 @@
 const spellContainer = document.getElementById("spell-cards")
-const base_url = 'https://www.dnd5eapi.co'
 
 let origHTML = {};
+let spellDetails = null;
+
+function getSpellDetails() {
+    // request the details for every spell card on the page in one request,
+    // the first time any card is expanded
+    if (!spellDetails) {
+        const ids = Array.from(document.querySelectorAll('.spell-card')).map(card => card.id)
+
+        spellDetails = axios.get('/api/spells', { params: { ids: ids.join(',') } })
+            .then(resp => Object.fromEntries(resp.data.spells.map(spell => [spell.id, spell])))
+    }
+    return spellDetails
+}
+
 async function handleCardClick(evt) {
     // get spell card
     spellCard = evt.target.closest('.spell-card')
@@ -11,11 +24,11 @@ async function handleCardClick(evt) {
         // keep initial html for spell card in variable
         origHTML[spellIndex] = spellCard.innerHTML
 
-        //make request to api for spell info
-        json = await axios.get(`${base_url}/api/spells/${spellIndex}`)
+        //get spell info from our server
+        details = await getSpellDetails()
 
         //update spellCard with new data
-        updateSpellCard(spellCard, json.data)
+        updateSpellCard(spellCard, details[spellCard.id])
 
     }
     else if (spellCard.classList.contains('large')) {
@@ -31,35 +44,33 @@ async function handleCardClick(evt) {
 function updateSpellCard(spell, data) {
     //card is html, spell is json data
 
-    let { components, desc, higher_level, material, ritual, area_of_effect, attack_type, damage} = data
+    let { components, desc, higher_level, material, ritual, area_of_effect, attack_type, damage_type } = data
 
     let cardBody = spell.querySelector('.card-body');
 
-    cardBody.innerHTML += (`<p>Components: ${components.join(', ')}</p> <p>Description: ${desc.join(" <br> ")}</p>`)
+    cardBody.innerHTML += (`<p>Components: ${components}</p> <p>Description: ${desc.join(" <br> ")}</p>`)
 
-    if(damage){
-        if('damage_type' in damage){
-            cardBody.innerHTML += (`<p>Damage Type: ${damage.damage_type.name}`)
-        }
+    if (damage_type) {
+        cardBody.innerHTML += (`<p>Damage Type: ${damage_type}`)
     }
 
-    if(attack_type){
+    if (attack_type) {
         cardBody.innerHTML += `<p>Attack Type: ${attack_type.charAt(0).toUpperCase() + attack_type.slice(1)}</p>`
     }
 
-    if(area_of_effect){
-        cardBody.innerHTML +=`<p>Area of Effect: ${area_of_effect.size} ft. ${area_of_effect.type}</p>`
+    if (area_of_effect) {
+        cardBody.innerHTML += `<p>Area of Effect: ${area_of_effect}</p>`
     }
 
-    if(material){
+    if (material) {
         cardBody.innerHTML += `<p>Material: ${material}</p>`
     }
 
-    if(higher_level.length > 0){
+    if (higher_level) {
         cardBody.innerHTML += `<p>Higher Level: ${higher_level}</p>`
     }
 
-    if(ritual){
+    if (ritual) {
         cardBody.innerHTML += `<p>This spell is a ritual</p>`
     }
 }
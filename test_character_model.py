@@ -3,6 +3,7 @@
 import os
 from unittest import TestCase
 
+import catalog
 from models import db, User, Character, Stats, Char_Class, Spell
 
 os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
@@ -157,6 +158,9 @@ class CharacterModelMethodsTestCase(TestCase):
         User.query.delete()
         Spell.query.delete()
 
+        #the spells are replaced without bumping the catalog version
+        catalog.invalidate()
+
         self.user = User(
             email="test@hotmail.com",
             username="testuser",
@@ -208,15 +212,6 @@ class CharacterModelMethodsTestCase(TestCase):
         self.assertIn(self.char.classes[0].class_name.index, info)
         self.assertIn(self.char.classes[0].level, info)
 
-    def test_get_class_spells(self):
-        '''Does get_class_spells return a set of available spells for the class?'''
-
-        spells = self.char.get_class_spells()
-
-        self.assertIsNotNone(spells)
-        self.assertTrue(isinstance(spells, set))
-        self.assertGreater(len(spells), 0)
-
     def test_get_spell_slots(self):
         '''Does get_spell_slots method return a list of spell slots?'''
 
@@ -0,0 +1,86 @@
+'''Connection pool configuration tests'''
+
+import os
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from models import db, connect_db, engine_options
+from instrumentation import TimedQueuePool
+
+os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
+
+from app import app
+
+def pool_config(**config):
+    '''Returns DB_* config with the app defaults, overridden by config'''
+    defaults = {'DB_POOL_SIZE': 5, 'DB_MAX_OVERFLOW': 10, 'DB_POOL_TIMEOUT': 30, 'DB_POOL_RECYCLE': 1800,
+                'DB_POOL_PRE_PING': True, 'DB_STATEMENT_TIMEOUT': 0, 'DB_PGBOUNCER': False}
+    return dict(defaults, **config)
+
+class EngineOptionsTestCase(TestCase):
+    '''Test building engine options from the app config'''
+
+    def test_pool_options(self):
+        '''Does the pool get its size, timeouts and statement timeout from the config?'''
+        options = engine_options(pool_config(DB_POOL_SIZE=3, DB_STATEMENT_TIMEOUT=5000))
+
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 10)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=5000'})
+
+    def test_pgbouncer_options(self):
+        '''Does pgbouncer mode leave pooling to pgbouncer?'''
+        options = engine_options(pool_config(DB_PGBOUNCER=True, DB_STATEMENT_TIMEOUT=5000))
+
+        self.assertEqual(options, {'poolclass': NullPool})
+
+    def test_pgbouncer_statement_timeout(self):
+        '''Is the statement timeout set in every transaction in pgbouncer mode?'''
+        pgbouncer_app = Flask(__name__)
+        pgbouncer_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+        pgbouncer_app.config.update(pool_config(DB_PGBOUNCER=True, DB_STATEMENT_TIMEOUT=1234))
+
+        connect_db(pgbouncer_app)
+
+        with pgbouncer_app.app_context():
+            #check that a new connection is used for each transaction
+            self.assertIsInstance(db.engine.pool, NullPool)
+
+            for _ in range(2):
+                with db.engine.begin() as conn:
+                    self.assertEqual(conn.execute(text('SHOW statement_timeout')).scalar(), '1234ms')
+
+    def test_pgbouncer_replica_statement_timeout(self):
+        '''Does the replica bind get the statement timeout in pgbouncer mode too?'''
+        pgbouncer_app = Flask(__name__)
+        pgbouncer_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+        pgbouncer_app.config['SQLALCHEMY_BINDS'] = {'replica': os.environ['DATABASE_URL']}
+        pgbouncer_app.config['REPLICA_STICKY_SECONDS'] = 5
+        pgbouncer_app.config.update(pool_config(DB_PGBOUNCER=True, DB_STATEMENT_TIMEOUT=1234))
+
+        connect_db(pgbouncer_app)
+
+        with pgbouncer_app.app_context():
+            with db.engines['replica'].begin() as conn:
+                self.assertEqual(conn.execute(text('SHOW statement_timeout')).scalar(), '1234ms')
+
+class TimedQueuePoolTestCase(TestCase):
+    '''Test the pool checkout stats'''
+
+    def test_checkout_stats(self):
+        '''Does the pool count checkouts and connections in use?'''
+        engine = create_engine(os.environ['DATABASE_URL'], poolclass=TimedQueuePool, pool_size=2)
+
+        with engine.connect():
+            stats = engine.pool.stats()
+
+            self.assertEqual(stats['in_use'], 1)
+            self.assertEqual(stats['checkouts'], 1)
+
+        self.assertEqual(engine.pool.stats()['in_use'], 0)
+        engine.dispose()
@@ -0,0 +1,87 @@
+'''dnd5eapi cache tests'''
+
+import time
+from unittest import TestCase
+
+from dnd_api import TTLCache, ApiClient, ApiUnavailable
+
+class TTLCacheTestCase(TestCase):
+    '''Test the api response cache'''
+
+    def test_cache_hit_miss(self):
+        '''Does the cache return stored values and count hits and misses?'''
+        cache = TTLCache(max_size=2, ttl=60)
+
+        self.assertIsNone(cache.get('wizard'))
+        cache.set('wizard', {'results': []})
+
+        #check that we get the stored value back
+        self.assertEqual(cache.get('wizard'), {'results': []})
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_cache_lru_eviction(self):
+        '''Does the cache evict the least recently used entry when full?'''
+        cache = TTLCache(max_size=2, ttl=60)
+
+        cache.set('wizard', 1)
+        cache.set('cleric', 2)
+
+        #use wizard so cleric is the least recently used
+        cache.get('wizard')
+        cache.set('druid', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('cleric'))
+        self.assertEqual(cache.get('wizard'), 1)
+        self.assertEqual(cache.get('druid'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_cache_ttl(self):
+        '''Do entries expire after the ttl?'''
+        cache = TTLCache(max_size=2, ttl=0.01)
+
+        cache.set('wizard', 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('wizard'))
+        self.assertEqual(len(cache), 0)
+
+class ApiClientTestCase(TestCase):
+    '''Test the api client circuit breaker'''
+
+    def test_breaker_opens(self):
+        '''Does the client fail fast after repeated errors?'''
+        client = ApiClient(breaker_threshold=2, breaker_cooldown=60)
+
+        #record two failed requests
+        client._record(time.monotonic(), failed=True)
+        self.assertFalse(client.breaker_open())
+        client._record(time.monotonic(), failed=True)
+
+        self.assertTrue(client.breaker_open())
+        self.assertEqual(client.stats()['errors'], 2)
+
+        #check that no request is made while the breaker is open
+        with self.assertRaises(ApiUnavailable):
+            client.get_json('/api/classes')
+
+    def test_breaker_cooldown(self):
+        '''Does the breaker close again after the cooldown?'''
+        client = ApiClient(breaker_threshold=1, breaker_cooldown=0)
+
+        client._record(time.monotonic(), failed=True)
+
+        self.assertFalse(client.breaker_open())
+
+    def test_breaker_disabled(self):
+        '''Does a client without a breaker threshold keep trying the api?'''
+        client = ApiClient(breaker_threshold=None)
+
+        for _ in range(10):
+            client._record(time.monotonic(), failed=True)
+
+        self.assertFalse(client.breaker_open())
+
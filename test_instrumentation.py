@@ -0,0 +1,35 @@
+'''SQL instrumentation tests'''
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import psycopg2
+
+os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
+
+from instrumentation import statement_shape
+from models import Spell
+
+def compiled(stmt):
+    '''Returns the sql psycopg2 is sent for stmt'''
+    return str(stmt.compile(dialect=psycopg2.dialect(), compile_kwargs={'render_postcompile': True}))
+
+class StatementShapeTestCase(TestCase):
+    '''Test grouping statements by shape'''
+
+    def test_in_lists(self):
+        '''Do IN lists of any length have the same shape?'''
+        two = compiled(select(Spell.id).where(Spell.id.in_([1, 2])))
+        three = compiled(select(Spell.id).where(Spell.id.in_([1, 2, 3])))
+
+        self.assertIn('%(id_1_1)s', two)
+        self.assertEqual(statement_shape(two), 'SELECT spells.id FROM spells WHERE spells.id IN (...)')
+        self.assertEqual(statement_shape(two), statement_shape(three))
+
+    def test_subqueries(self):
+        '''Are subqueries in IN lists left alone?'''
+        stmt = compiled(select(Spell.id).where(Spell.id.in_(select(Spell.id).where(Spell.level.in_([1, 2])))))
+
+        self.assertIn('spells.id IN (SELECT spells.id FROM spells WHERE spells.level IN (...))',
+                      statement_shape(stmt))
@@ -0,0 +1,191 @@
+'''Query budget tests
+
+Every route should make a fixed number of SQL queries and dnd5eapi requests,
+however many characters and spell lists the user has. A change that adds
+lazy loads per row or new api calls to a route will push it over budget.'''
+
+import os
+from datetime import date
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+
+import catalog
+from models import db, User, Character, Stats, Char_Class, Spell, SpellList
+
+os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
+
+from app import app
+
+app.app_context().push()
+
+#disable WTForms csrf for testing
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+
+test_password = 'HASHED_PASSWORD'
+
+NUM_CHARACTERS = 25
+LISTS_PER_CHARACTER = 3
+
+class QueryBudgetTestCase(TestCase):
+    '''Test the number of queries and api requests each route makes'''
+
+    def setUp(self):
+        Character.query.delete()
+        User.query.delete()
+        Spell.query.delete()
+        SpellList.query.delete()
+
+        #the spells are replaced without bumping the catalog version
+        catalog.invalidate()
+
+        app.config['SQL_QUERY_STATS'] = True
+        self.client = app.test_client()
+
+        user = User.signup(
+            username='test_user',
+            password= test_password,
+            email='test@hotmail.com'
+        )
+
+        spells = [Spell(index='cure-wounds', name='Cure Wounds', level=1),
+                  Spell(index='guidance', name='Guidance', level=0),
+                  Spell(index='thunderwave', name='Thunderwave', level=1)]
+        db.session.add_all(spells)
+
+        # a user with many characters, each with a few spell lists
+        for i in range(NUM_CHARACTERS):
+            char = Character(name=f'TestChar{i}')
+            char.stats = Stats(HP=10, STR=10, DEX=10, CON=10, INT=10, WIS=10, CHA=10)
+            char.classes.append(Char_Class(class_id=4, level=4))
+
+            for j in range(LISTS_PER_CHARACTER):
+                spell_list = SpellList(name=f'Test Spell List {i}-{j}', date=date.today())
+                spell_list.spells.extend(spells)
+                char.spell_lists.append(spell_list)
+
+            user.characters.append(char)
+
+        db.session.commit()
+
+        self.user_id = user.id
+        self.char_id = user.characters[0].id
+        self.list_id = user.characters[0].spell_lists[0].id
+        self.spell_ids = [spell.id for spell in spells]
+
+        self.client.post('/login', data={'username': 'test_user', 'password': test_password})
+
+    def tearDown(self):
+        app.config['SQL_QUERY_STATS'] = False
+        db.session.rollback()
+
+    def assertWithinBudget(self, method, url, max_queries, max_api_requests=0, data=None):
+        '''Make a request and check its query count and api requests against the budget'''
+
+        # start from an empty session, like a new request would
+        db.session.remove()
+
+        # count every outgoing http request, not just the ones made through dnd_api.client
+        with patch.object(requests.Session, 'send', autospec=True, side_effect=requests.Session.send) as send:
+            resp = getattr(self.client, method)(url, data=data)
+
+        queries = int(resp.headers['X-Query-Count'])
+        self.assertLessEqual(queries, max_queries, f'{method.upper()} {url} made {queries} queries')
+        self.assertLessEqual(send.call_count, max_api_requests,
+                             f'{method.upper()} {url} made {send.call_count} requests to the api')
+
+        return resp
+
+    def test_auth_budget(self):
+        '''Do the home, signup, login and logout pages stay within budget?'''
+        resp = self.assertWithinBudget('get', '/', 1)
+        self.assertEqual(resp.status_code, 302)
+
+        resp = self.assertWithinBudget('get', '/logout', 0)
+        self.assertEqual(resp.status_code, 302)
+
+        resp = self.assertWithinBudget('get', '/', 0)
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.assertWithinBudget('get', '/signup', 0)
+        self.assertEqual(resp.status_code, 200)
+
+        data = {'username': 'new_user', 'email': 'new@hotmail.com', 'password': test_password, 'confirm': test_password}
+        resp = self.assertWithinBudget('post', '/signup', 4, data=data)
+        self.assertEqual(resp.status_code, 302)
+
+        self.client.get('/logout')
+
+        resp = self.assertWithinBudget('get', '/login', 0)
+        self.assertEqual(resp.status_code, 200)
+
+        data = {'username': 'test_user', 'password': test_password}
+        resp = self.assertWithinBudget('post', '/login', 1, data=data)
+        self.assertEqual(resp.status_code, 302)
+
+    def test_user_page_budget(self):
+        '''Does the profile page stay within budget?'''
+        resp = self.assertWithinBudget('get', f'/user/{self.user_id}', 5)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_char_details_budget(self):
+        '''Does the character details page stay within budget?'''
+        resp = self.assertWithinBudget('get', f'/char/{self.char_id}', 7)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_char_forms_budget(self):
+        '''Do the character forms stay within budget?'''
+        resp = self.assertWithinBudget('get', '/characters/new', 3)
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.assertWithinBudget('get', f'/char/{self.char_id}/edit', 7)
+        self.assertEqual(resp.status_code, 200)
+
+        data = {'name': 'edit_test', 'HP': 10, 'STR': 5, 'DEX': 5, 'CON': 5,
+                'INT': 5, 'WIS': 5, 'CHA': 5, 'class_id': 4, 'level': 2}
+        resp = self.assertWithinBudget('post', f'/char/{self.char_id}/edit', 12, data=data)
+        self.assertEqual(resp.status_code, 302)
+
+        resp = self.assertWithinBudget('post', '/characters/new', 9, data=data)
+        self.assertEqual(resp.status_code, 302)
+
+    def test_new_spell_list_budget(self):
+        '''Does the spell list builder stay within budget?'''
+        resp = self.assertWithinBudget('get', f'/char/{self.char_id}/spell_list/new', 10)
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.assertWithinBudget('get', f'/api/char/{self.char_id}/spells', 7)
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.assertWithinBudget('get', f'/api/char/{self.char_id}/spells/search?name=cure', 7)
+        self.assertEqual(resp.status_code, 200)
+
+        data = {'spells': self.spell_ids[:2], 'name': 'test_spell_list'}
+        resp = self.assertWithinBudget('post', f'/char/{self.char_id}/spell_list/new', 12, data=data)
+        self.assertEqual(resp.status_code, 302)
+
+    def test_spell_list_details_budget(self):
+        '''Does the spell list page stay within budget?'''
+        resp = self.assertWithinBudget('get', f'/char/{self.char_id}/spell_list/{self.list_id}', 5)
+        self.assertEqual(resp.status_code, 200)
+
+        ids = ','.join(str(_id) for _id in self.spell_ids)
+        resp = self.assertWithinBudget('get', f'/api/spells?ids={ids}', 3)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_delete_budget(self):
+        '''Do the delete routes stay within budget?'''
+        resp = self.assertWithinBudget('post', f'/spell_list/{self.list_id}/delete', 8)
+        self.assertEqual(resp.status_code, 302)
+
+        resp = self.assertWithinBudget('post', f'/char/{self.char_id}/delete', 4)
+        self.assertEqual(resp.status_code, 302)
+
+        resp = self.assertWithinBudget('post', f'/user/{self.user_id}/delete', 6)
+        self.assertEqual(resp.status_code, 302)
+
+        #check that the users characters and spell lists went with them
+        self.assertEqual(Character.query.count(), 0)
+        self.assertEqual(SpellList.query.count(), 0)
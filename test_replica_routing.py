@@ -0,0 +1,89 @@
+'''Read replica routing tests'''
+
+import os
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import event, select
+
+from models import db, connect_db, Spell
+
+os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
+
+from app import app
+
+# an app whose replica bind is a second engine on the test database
+replica_app = Flask(__name__)
+replica_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+replica_app.config['SQLALCHEMY_BINDS'] = {'replica': os.environ['DATABASE_URL']}
+replica_app.config['REPLICA_STICKY_SECONDS'] = 5
+replica_app.config['SECRET_KEY'] = 'test'
+replica_app.config['TESTING'] = True
+
+connect_db(replica_app)
+
+def bind_name():
+    '''Returns which engine the session reads from'''
+    return 'replica' if db.session.get_bind() is db.engines['replica'] else 'primary'
+
+@replica_app.route('/bind')
+def show_bind():
+    return bind_name()
+
+@replica_app.route('/write', methods=['POST'])
+def write():
+    db.session.execute(select(1))
+    db.session.commit()
+    return bind_name()
+
+@replica_app.route('/flush')
+def flush():
+    # a GET that writes anyway, its flush has to go to the primary
+    db.session.add(Spell(index='replica-test', name='Replica Test', level=0))
+    db.session.flush()
+    db.session.rollback()
+    return bind_name()
+
+class ReplicaRoutingTestCase(TestCase):
+    '''Test sending read-only requests to the replica'''
+
+    def setUp(self):
+        replica_app.config['REPLICA_STICKY_SECONDS'] = 5
+        self.client = replica_app.test_client()
+
+    def test_get_uses_replica(self):
+        '''Do GET requests read from the replica and POSTs from the primary?'''
+        self.assertEqual(self.client.get('/bind').get_data(as_text=True), 'replica')
+        self.assertEqual(self.client.post('/write').get_data(as_text=True), 'primary')
+
+    def test_flush_uses_primary(self):
+        '''Do flushes in a GET request write to the primary?'''
+        engines = []
+
+        with replica_app.app_context():
+            primary, replica = db.engines[None], db.engines['replica']
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT'):
+                engines.append('replica' if conn.engine is replica else 'primary')
+
+        event.listen(replica, 'before_cursor_execute', record)
+        event.listen(primary, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(self.client.get('/flush').get_data(as_text=True), 'replica')
+        finally:
+            event.remove(replica, 'before_cursor_execute', record)
+            event.remove(primary, 'before_cursor_execute', record)
+
+        self.assertEqual(engines, ['primary'])
+
+    def test_read_your_writes(self):
+        '''Do GETs read from the primary for REPLICA_STICKY_SECONDS after a write?'''
+        self.client.post('/write')
+
+        #check that the next read sees the write
+        self.assertEqual(self.client.get('/bind').get_data(as_text=True), 'primary')
+
+        #check that reads go back to the replica once the window is over
+        replica_app.config['REPLICA_STICKY_SECONDS'] = 0
+        self.assertEqual(self.client.get('/bind').get_data(as_text=True), 'replica')
@@ -0,0 +1,157 @@
+'''Seeder tests'''
+
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+
+import catalog
+import dnd_api
+
+os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
+
+from seed import spell_row, write_snapshot, read_snapshot, refresh_db, fetch_all
+from models import db, Classes, Subclasses, Spell, SpellList, ClassSpell, ClassLevel
+
+def table_rows(model):
+    '''Returns the rows of a table as seeder rows, without their ids'''
+    return [{col.name: getattr(obj, col.name) for col in model.__table__.columns if col.name != 'id'}
+            for obj in db.session.query(model).order_by(model.id)]
+
+fireball = {'index': 'fireball', 'name': 'Fireball', 'range': '150 feet', 'duration': 'Instantaneous',
+            'concentration': False, 'casting_time': '1 action', 'level': 3,
+            'school': {'name': 'Evocation'}, 'damage': {'damage_type': {'name': 'Fire'}}}
+
+class SeedTestCase(TestCase):
+    '''Test the seeder helpers that don't need the api'''
+
+    def test_spell_row(self):
+        '''Does spell_row build a spells table row from an api response?'''
+        row = spell_row(fireball)
+
+        self.assertEqual(row['index'], 'fireball')
+        self.assertEqual(row['school'], 'Evocation')
+        self.assertTrue(row['damaging'])
+        self.assertFalse(row['healing'])
+
+    def test_snapshot_round_trip(self):
+        '''Does a snapshot file load back the data it was saved with?'''
+        data = {'classes': [{'index': 'wizard', 'name': 'Wizard', 'url': '/api/classes/wizard'}],
+                'subclasses': [], 'spells': [fireball],
+                'class_spells': [{'class_index': 'wizard', 'spell_index': 'fireball'}],
+                'class_levels': []}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'srd.json.gz')
+            write_snapshot(data, path)
+
+            self.assertEqual(read_snapshot(path), data)
+
+class FlakyApiHandler(BaseHTTPRequestHandler):
+    '''Fails the first `failures` requests with a 503, then answers every request'''
+    failures = 0
+    requests = 0
+
+    def do_GET(self):
+        FlakyApiHandler.requests += 1
+
+        if FlakyApiHandler.requests <= FlakyApiHandler.failures:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'path': self.path}).encode())
+
+    def log_message(self, *args):
+        pass
+
+class FetchTestCase(TestCase):
+    '''Test fetching from an api that fails for a while'''
+
+    def setUp(self):
+        FlakyApiHandler.requests = 0
+        self.server = HTTPServer(('127.0.0.1', 0), FlakyApiHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.base_url = dnd_api.base_url
+        dnd_api.base_url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        dnd_api.base_url = self.base_url
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_all_recovers(self):
+        '''Does the seeder keep retrying through a burst of failures?'''
+        FlakyApiHandler.failures = 5
+        paths = [f'/api/spells/{i}' for i in range(6)]
+
+        results = fetch_all(paths, 'spells', concurrency=6)
+
+        self.assertEqual(results, [{'path': path} for path in paths])
+
+        #check that each failed request was tried once more, not retried inside the client too
+        self.assertEqual(FlakyApiHandler.requests, 11)
+
+class RefreshTestCase(TestCase):
+    '''Test refreshing the api data in place'''
+
+    def setUp(self):
+        SpellList.query.delete()
+        Spell.query.delete()
+        db.session.commit()
+        catalog.invalidate()
+
+        # refresh with the class data already in the database so only the test changes show up
+        self.data = {'classes': table_rows(Classes), 'subclasses': table_rows(Subclasses),
+                     'spells': [fireball], 'class_spells': table_rows(ClassSpell),
+                     'class_levels': table_rows(ClassLevel)}
+
+    def tearDown(self):
+        db.session.rollback()
+
+        # put back the class data the tests changed
+        refresh_db(self.data)
+        Spell.query.delete()
+        db.session.commit()
+
+    def test_refresh_counts(self):
+        '''Does refreshing insert new rows once and leave unchanged rows alone?'''
+        report = refresh_db(self.data)
+
+        self.assertEqual(report['spells']['inserted'], 1)
+        self.assertEqual(report['classes']['unchanged'], len(self.data['classes']))
+        self.assertEqual(report['class levels']['updated'], 0)
+
+        #check that a second refresh changes nothing
+        report = refresh_db(self.data)
+
+        self.assertEqual(report['spells'], {'inserted': 0, 'updated': 0, 'unchanged': 1, 'deleted': 0})
+        self.assertEqual(report['class spells']['unchanged'], len(self.data['class_spells']))
+        self.assertEqual(report['class levels']['unchanged'], len(self.data['class_levels']))
+
+    def test_refresh_changes(self):
+        '''Does refreshing update changed rows and delete class rows missing from the api data?'''
+        refresh_db(self.data)
+
+        level = dict(self.data['class_levels'][0], spellcasting={'cantrips_known': 99})
+        data = dict(self.data, spells=[dict(fireball, range='300 feet')],
+                    class_levels=[level] + self.data['class_levels'][1:],
+                    class_spells=self.data['class_spells'][1:])
+
+        report = refresh_db(data)
+
+        self.assertEqual(report['spells']['updated'], 1)
+        self.assertEqual(report['class levels']['updated'], 1)
+        self.assertEqual(report['class levels']['unchanged'], len(self.data['class_levels']) - 1)
+        self.assertEqual(report['class spells']['deleted'], 1)
+
+        #check that the changes were saved
+        self.assertEqual(Spell.query.filter_by(index='fireball').one().range, '300 feet')
+        self.assertEqual(ClassSpell.query.count(), len(self.data['class_spells']) - 1)
+
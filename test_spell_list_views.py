@@ -3,6 +3,7 @@
 import os
 from unittest import TestCase
 
+import catalog
 from models import db, User, Character, Stats, Char_Class, Spell, SpellList
 
 os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
@@ -25,6 +26,9 @@ class SpellListViewsTestCase(TestCase):
         Spell.query.delete()
         SpellList.query.delete()
 
+        #the spells are replaced without bumping the catalog version
+        catalog.invalidate()
+
         self.client = app.test_client()
 
         self.user = User.signup(
@@ -78,9 +82,16 @@ class SpellListViewsTestCase(TestCase):
             #do we get an ok status code
             self.assertEqual(resp.status_code, 200)
 
-            self.assertIn('Cure Wounds', html)
-            self.assertIn('Guidance', html)
-            self.assertIn(f'<option value="{self.spell1.id}"', html)
+            self.assertIn('New Spell List for TestChar', html)
+            self.assertIn(f'data-spells-url="/api/char/{self.char.id}/spells"', html)
+
+            #check that the spell options are left to the page script
+            self.assertNotIn('<option', html)
+
+            #check that the login flash is shown once and not again on the next page
+            self.assertIn('Hello, test_user!', html)
+            resp = client.get(f'/char/{self.char.id}/spell_list/new')
+            self.assertNotIn('Hello, test_user!', resp.get_data(as_text=True))
 
     def test_new_spell_list_post(self):
         '''Does the new spell list post route work as intended'''
@@ -88,7 +99,12 @@ class SpellListViewsTestCase(TestCase):
             login = {'username': self.user.username, 'password':test_password}
             client.post('/login', data=login)
 
-            data = {'spells': [self.spell1.id, self.spell2.id], 'name': 'test_spell_list'}
+            # a spell the character's classes can't cast
+            fireball = Spell(index='fireball', name='Fireball', level=3)
+            db.session.add(fireball)
+            db.session.commit()
+
+            data = {'spells': [self.spell1.id, self.spell2.id, fireball.id], 'name': 'test_spell_list'}
 
             resp = client.post(f'/char/{self.char.id}/spell_list/new', data=data)
 
@@ -108,6 +124,96 @@ class SpellListViewsTestCase(TestCase):
             self.assertIn(self.spell1.id, spells)
             self.assertIn(self.spell2.id, spells)
 
+            #check that spells that aren't available are left out
+            self.assertNotIn(fireball.id, spells)
+
+    def test_spell_details_api(self):
+        '''Does the spell details endpoint return every requested spell in one response?'''
+        with self.client as client:
+            resp = client.get(f'/api/spells?ids={self.spell1.id},{self.spell2.id}')
+            spells = {spell['id']: spell for spell in resp.json['spells']}
+
+            #check that we get an ok status code
+            self.assertEqual(resp.status_code, 200)
+
+            #check that both spells are in the response
+            self.assertEqual(len(spells), 2)
+            self.assertEqual(spells[self.spell1.id]['index'], 'cure-wounds')
+
+            #check that bad ids are rejected
+            resp = client.get('/api/spells?ids=cure-wounds')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_available_spells_api(self):
+        '''Does the available spells endpoint page through the characters spells in order?'''
+        with self.client as client:
+            #check that only the owner can get the spells
+            resp = client.get(f'/api/char/{self.char.id}/spells')
+            self.assertEqual(resp.status_code, 403)
+
+            login = {'username': self.user.username, 'password':test_password}
+            client.post('/login', data=login)
+
+            resp = client.get(f'/api/char/{self.char.id}/spells?limit=1')
+
+            #check that we get the lowest level spell and a key for the next page
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([spell['name'] for spell in resp.json['spells']], ['Guidance'])
+            self.assertEqual(resp.json['next'], {'level': 0, 'name': 'Guidance'})
+            self.assertIn('card-header', resp.json['spells'][0]['card'])
+
+            resp = client.get(f'/api/char/{self.char.id}/spells', query_string=dict(resp.json['next'], limit=1))
+
+            #check that the next page starts after the last spell and is the last page
+            self.assertEqual([spell['name'] for spell in resp.json['spells']], ['Cure Wounds'])
+            self.assertIsNone(resp.json['next'])
+
+            #check that spells can be fetched by id
+            resp = client.get(f'/api/char/{self.char.id}/spells?ids={self.spell1.id}')
+            self.assertEqual([spell['name'] for spell in resp.json['spells']], ['Cure Wounds'])
+            self.assertIsNone(resp.json['next'])
+
+            #check that page sizes below 1 are rejected
+            resp = client.get(f'/api/char/{self.char.id}/spells?limit=0')
+            self.assertEqual(resp.status_code, 400)
+
+            resp = client.get(f'/api/char/{self.char.id}/spells?limit=-1')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_search_spells_api(self):
+        '''Does the spell search endpoint return the ids of the matching spells?'''
+        with self.client as client:
+            login = {'username': self.user.username, 'password':test_password}
+            client.post('/login', data=login)
+
+            resp = client.get(f'/api/char/{self.char.id}/spells/search')
+
+            #check that all available spells come back in level and name order
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['ids'], [self.spell2.id, self.spell1.id])
+
+            resp = client.get(f'/api/char/{self.char.id}/spells/search?name=cure&level=1')
+            self.assertEqual(resp.json['ids'], [self.spell1.id])
+
+            #check that bad levels are rejected
+            resp = client.get(f'/api/char/{self.char.id}/spells/search?level=first')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_search_new_spells(self):
+        '''Do spells added without bumping the catalog version show up in searches?'''
+        with self.client as client:
+            login = {'username': self.user.username, 'password':test_password}
+            client.post('/login', data=login)
+
+            client.get(f'/api/char/{self.char.id}/spells/search')
+
+            healing_word = Spell(index='healing-word', name='Healing Word', level=1)
+            db.session.add(healing_word)
+            db.session.commit()
+
+            resp = client.get(f'/api/char/{self.char.id}/spells/search?level=1')
+            self.assertEqual(resp.json['ids'], [self.spell1.id, healing_word.id])
+
     def add_spell_list_to_char(self):
         '''Add spell lists to self.character'''
         spell_list = SpellList(char_id=self.char.id, name='Test Spell List')
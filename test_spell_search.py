@@ -0,0 +1,41 @@
+'''Spell search index tests'''
+
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
+
+from spell_search import SpellIndex
+
+# (id, name, level, school, damaging, healing, concentration) in level and name order
+spells = [(2, 'Guidance', 0, 'Divination', False, False, True),
+          (5, 'Cure Wounds', 1, 'Evocation', False, True, False),
+          (3, 'Healing Word', 1, 'Evocation', False, True, False),
+          (1, 'Fireball', 3, 'Evocation', True, False, False)]
+
+class SpellIndexTestCase(TestCase):
+    '''Test searching the spell bitmaps'''
+
+    def setUp(self):
+        self.index = SpellIndex(spells)
+        self.available = self.index.bitmap([1, 2, 3, 5])
+
+    def test_search_filters(self):
+        '''Does each filter return the matching spells in level and name order?'''
+        self.assertEqual(self.index.search(self.available), [2, 5, 3, 1])
+        self.assertEqual(self.index.search(self.available, level=1), [5, 3])
+        self.assertEqual(self.index.search(self.available, school='evocation', healing=True), [5, 3])
+        self.assertEqual(self.index.search(self.available, concentration=True), [2])
+        self.assertEqual(self.index.search(self.available, damaging=True, healing=True), [])
+
+    def test_search_name(self):
+        '''Does the name search match the start of words in the name?'''
+        self.assertEqual(self.index.search(self.available, name='heal'), [3])
+        self.assertEqual(self.index.search(self.available, name='cure wou'), [5])
+        self.assertEqual(self.index.search(self.available, name='ounds'), [])
+
+    def test_search_available(self):
+        '''Does the search only return available spells?'''
+        available = self.index.bitmap([5, 1])
+
+        self.assertEqual(self.index.search(available, school='Evocation'), [5, 1])
@@ -3,7 +3,7 @@
 import os
 from unittest import TestCase
 
-from models import db, User
+from models import db, User, Character, CurrentUser, UserNotFound
 
 os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
 
@@ -41,4 +41,51 @@ class UserModelTestCase(TestCase):
         #User __repr__ method returns correct value
         self.assertIn(str(user.id), user.__repr__())
         self.assertIn(user.email, user.__repr__())
-        self.assertIn(user.username, user.__repr__())
\ No newline at end of file
+        self.assertIn(user.username, user.__repr__())
+
+    def test_user_character_checks(self):
+        '''Do the character ownership and duplicate checks work?'''
+
+        user = User(
+            email="test@hotmail.com",
+            username="testuser",
+            password="HASHED_PASSWORD"
+        )
+
+        char = Character(name='TestChar')
+        user.characters.append(char)
+
+        db.session.add(user)
+        db.session.commit()
+
+        #check that the users character is found by name and id
+        self.assertTrue(user.user_dupe_character('TestChar'))
+        self.assertFalse(user.user_dupe_character('OtherChar'))
+        self.assertTrue(user.owns_character(char.id))
+        self.assertFalse(user.owns_character(char.id + 1))
+
+        #check that a character without lists has no spell lists
+        self.assertFalse(user.has_spell_lists())
+
+    def test_current_user_deleted(self):
+        '''Does the session user stand-in raise UserNotFound once the user is deleted?'''
+
+        user = User(
+            email="test@hotmail.com",
+            username="testuser",
+            password="HASHED_PASSWORD"
+        )
+
+        db.session.add(user)
+        db.session.commit()
+
+        current = CurrentUser(user.id, user.username)
+        self.assertEqual(current.email, "test@hotmail.com")
+
+        db.session.delete(user)
+        db.session.commit()
+
+        #check that a fresh stand-in can't load the deleted user
+        with self.assertRaises(UserNotFound):
+            CurrentUser(user.id, user.username).email
+
@@ -8,7 +8,7 @@ from models import db, User
 
 os.environ['DATABASE_URL'] = 'postgresql:///spell-tracker-test'
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, CURR_USERNAME_KEY
 
 app.app_context().push()
 
@@ -79,6 +79,9 @@ class UserViewTestCase(TestCase):
             #check that current user in session matched our user id
             self.assertEqual(session.get(CURR_USER_KEY), self.user.id)
 
+            #check that the username is kept in the session for g.user
+            self.assertEqual(session.get(CURR_USERNAME_KEY), self.user.username)
+
     def test_user_logout(self):
         '''Test user logout method'''
 
@@ -96,5 +99,24 @@ class UserViewTestCase(TestCase):
 
             #check that current user is removed from session
             self.assertIsNone(session.get(CURR_USER_KEY))
+            self.assertIsNone(session.get(CURR_USERNAME_KEY))
+
+    def test_deleted_user_session(self):
+        '''Is a session for a deleted account treated as logged out?'''
+        with self.client as client:
+            client.post('/login', data={'username': self.user.username, 'password': test_password})
+
+            #delete the account from somewhere else
+            User.query.filter_by(id=self.user.id).delete()
+            db.session.commit()
+
+            resp = client.get(f'/user/{self.user.id}')
+
+            #check that we are sent home and logged out
+            self.assertEqual(resp.status_code, 302)
+            self.assertIsNone(session.get(CURR_USER_KEY))
+            self.assertIsNone(session.get(CURR_USERNAME_KEY))
 
+            resp = client.get('/')
+            self.assertEqual(resp.status_code, 200)
 